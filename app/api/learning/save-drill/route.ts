@@ -8,8 +8,15 @@ export const runtime = "nodejs";
 export async function POST(request: NextRequest) {
   try {
     const body = await request.json();
+    const { searchParams } = new URL(request.url);
 
-    const resp = await fetch(`${PYTHON_API_URL}/learning/save-drill`, {
+    const url = new URL(`${PYTHON_API_URL}/learning/save-drill`);
+    // wait=true の場合、Python側で書き込みが終わるまで待ってから応答する
+    if (searchParams.get("wait") === "true") {
+      url.searchParams.set("wait", "true");
+    }
+
+    const resp = await fetch(url.toString(), {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
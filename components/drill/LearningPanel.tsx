@@ -98,7 +98,8 @@ export default function LearningPanel({
         })),
       };
 
-      const response = await fetch("/api/learning/save-drill", {
+      // 直後にパターンを再読み込みするため、書き込み完了まで待つ
+      const response = await fetch("/api/learning/save-drill?wait=true", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -0,0 +1,154 @@
+"""
+学習データの一括インポート / エクスポート（NDJSON: 1行1ドリル）
+
+インポートは受信ストリームを行単位に区切り、IMPORT_CHUNK_SIZE 行ごとのチャンクを
+ワーカースレッドで検証・特徴量計算し、チャンク単位で1トランザクションとして保存する。
+同時に処理するチャンク数を制限しているため、リクエストの大きさに関わらずメモリ使用量は一定。
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from app.learning import DrillData, prepare_drill_for_learning
+from app.observability import stage
+from app.responses import dumps
+from app.storage import DrillItem, check_drill_key, get_learning_store, resolve_user_id
+
+
+IMPORT_CHUNK_SIZE = 200  # 1チャンク（=1トランザクション）あたりの行数
+IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+IMPORT_MAX_IN_FLIGHT = IMPORT_WORKERS * 2  # 同時に保持するチャンク数の上限
+IMPORT_MAX_LINE_BYTES = 32 * 1024 * 1024  # 1行（1ドリル）の最大サイズ
+IMPORT_MAX_ERRORS = 1000  # レスポンスに含めるエラーの最大件数
+EXPORT_BATCH_SIZE = 200
+
+_executor = ThreadPoolExecutor(max_workers=IMPORT_WORKERS, thread_name_prefix="learning-import")
+
+Line = Tuple[int, bytes]  # (行番号, 行の内容)
+
+
+class ImportLineTooLarge(Exception):
+    """1行がIMPORT_MAX_LINE_BYTESを超えている"""
+
+
+def format_error(error: Exception) -> str:
+    """検証エラーを「項目: メッセージ」の1行にまとめる"""
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" if e["loc"] else e["msg"]
+            for e in error.errors()
+        )
+    return str(error)
+
+
+def _import_chunk(lines: List[Line]) -> Tuple[int, List[Dict[str, Any]]]:
+    """1チャンク分を検証・特徴量計算してまとめて保存。(保存件数, エラー) を返す"""
+    items: List[DrillItem] = []
+    item_lines: List[Tuple[int, str]] = []
+    errors: List[Dict[str, Any]] = []
+    for line_no, raw in lines:
+        try:
+            with stage("learning.import_validate"):
+                drill = DrillData.model_validate_json(raw)
+            user_id = resolve_user_id({"userId": drill.userId, "metadata": drill.metadata})
+            check_drill_key(drill.drillId, user_id)
+            with stage("learning.prepare"):
+                record = prepare_drill_for_learning(drill)
+        except Exception as e:
+            errors.append({"line": line_no, "error": format_error(e)})
+            continue
+        items.append((record, user_id))
+        item_lines.append((line_no, record["drillId"]))
+
+    if not items:
+        return 0, errors
+    try:
+        with stage("learning.store_write"):
+            saved = get_learning_store().save_drills(items)
+    except Exception as e:
+        # チャンクは1トランザクションなので、失敗した場合はチャンク内の全件が未保存
+        errors.extend(
+            {"line": line_no, "drillId": drill_id, "error": f"保存に失敗しました: {e}"}
+            for line_no, drill_id in item_lines
+        )
+        return 0, errors
+    return saved, errors
+
+
+async def _iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Line]:
+    # 長い行が複数のチャンクに分かれて届く場合に、受信のたびに行全体をコピー・走査し直さないよう
+    # bytearray に追記し、改行は新しく受け取った部分だけを探す
+    buffer = bytearray()
+    line_no = 0
+    async for data in stream:
+        scan_from = len(buffer)
+        buffer += data
+        start = 0
+        end = buffer.find(b"\n", scan_from)
+        while end != -1:
+            line_no += 1
+            raw = bytes(buffer[start:end])
+            if raw.strip():
+                yield line_no, raw
+            start = end + 1
+            end = buffer.find(b"\n", start)
+        del buffer[:start]
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise ImportLineTooLarge(f"{line_no + 1}行目が大きすぎます")
+    if buffer.strip():
+        yield line_no + 1, bytes(buffer)
+
+
+async def import_ndjson(stream: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """NDJSONストリームを取り込み、件数と行ごとのエラーを返す
+
+    チャンクは並列に保存されるため、同じ drillId が複数回含まれる場合にどれが残るかは保証しない。
+    """
+    loop = asyncio.get_running_loop()
+    pending: Set["asyncio.Future[Tuple[int, List[Dict[str, Any]]]]"] = set()
+    summary: Dict[str, Any] = {"received": 0, "imported": 0, "failed": 0, "errors": [], "errorsTruncated": False}
+
+    def collect(done: Set["asyncio.Future[Tuple[int, List[Dict[str, Any]]]]"]) -> None:
+        for future in done:
+            saved, errors = future.result()
+            summary["imported"] += saved
+            summary["failed"] += len(errors)
+            room = IMPORT_MAX_ERRORS - len(summary["errors"])
+            summary["errors"].extend(errors[:max(room, 0)])
+            if len(errors) > room:
+                summary["errorsTruncated"] = True
+
+    async def submit(chunk: List[Line]) -> None:
+        nonlocal pending
+        if len(pending) >= IMPORT_MAX_IN_FLIGHT:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+        pending.add(loop.run_in_executor(_executor, _import_chunk, chunk))
+
+    try:
+        chunk: List[Line] = []
+        async for line in _iter_lines(stream):
+            summary["received"] += 1
+            chunk.append(line)
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await submit(chunk)
+                chunk = []
+        if chunk:
+            await submit(chunk)
+    finally:
+        # 途中で失敗した場合も、投入済みのチャンクは最後まで処理させる
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            collect(done)
+
+    summary["errors"].sort(key=lambda e: e["line"])
+    return summary
+
+
+def export_ndjson(user_id: Optional[str] = None) -> Iterator[bytes]:
+    """学習データをNDJSONとして1行ずつ返す"""
+    for drill in get_learning_store().iter_drills(user_id, batch_size=EXPORT_BATCH_SIZE):
+        yield dumps(drill) + b"\n"
@@ -1,17 +1,23 @@
 """
 ドリル学習システム: パターン抽出・分析・提案
 """
-import json
-import os
-from typing import Optional, Dict, List, Any
-from pathlib import Path
+import threading
+from typing import Optional, Dict, List, Any, Tuple
 import numpy as np
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, field_validator
 
+from app.observability import stage
+from app.similarity import compute_descriptors, get_formation_index
+from app.storage import get_learning_store, resolve_user_id
 
-# データ保存先（簡易版: ファイルベース、後でDBに移行可能）
-LEARNING_DATA_DIR = Path(__file__).parent.parent / "data" / "learning"
-LEARNING_DATA_DIR.mkdir(parents=True, exist_ok=True)
+
+def _check_positions(positions: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    """各メンバーの座標に x と y があるか検証（特徴量計算の前に弾く）"""
+    for member_id, p in positions.items():
+        missing = [axis for axis in ("x", "y") if axis not in p]
+        if missing:
+            raise ValueError(f"メンバー {member_id} の座標に {', '.join(missing)} がありません")
+    return positions
 
 
 class DrillSet(BaseModel):
@@ -22,6 +28,9 @@ class DrillSet(BaseModel):
     positions: Dict[str, Dict[str, float]]  # {memberId: {x, y}}
     formationType: Optional[str] = None
     features: Optional[Dict[str, float]] = None
+    descriptor: Optional[List[float]] = None  # 類似検索用の形状記述子（保存時に計算）
+
+    _validate_positions = field_validator("positions")(_check_positions)
 
 
 class Transition(BaseModel):
@@ -36,6 +45,7 @@ class Transition(BaseModel):
 
 class DrillData(BaseModel):
     drillId: str
+    userId: Optional[str] = None  # 未指定の場合は metadata.createdBy を使用
     title: Optional[str] = None
     metadata: Dict[str, Any]
     members: List[Dict[str, Any]]
@@ -44,246 +54,278 @@ class DrillData(BaseModel):
     patterns: Optional[List[Dict[str, Any]]] = None
 
 
-def calculate_formation_type(positions: Dict[str, Dict[str, float]]) -> str:
-    """フォーメーションタイプを判定"""
-    if len(positions) < 3:
-        return "custom"
-    
-    pos_list = list(positions.values())
-    xs = [p["x"] for p in pos_list]
-    ys = [p["y"] for p in pos_list]
-    
-    # 中心を計算
-    center_x = np.mean(xs)
-    center_y = np.mean(ys)
-    
-    # 中心からの距離
-    distances = [np.sqrt((p["x"] - center_x)**2 + (p["y"] - center_y)**2) for p in pos_list]
-    avg_distance = np.mean(distances)
-    std_distance = np.std(distances)
-    
-    # 円形判定: 距離のばらつきが小さい
-    if std_distance / (avg_distance + 1e-6) < 0.3:
-        return "circle"
-    
-    # 直線判定: XまたはYのばらつきが小さい
-    std_x = np.std(xs)
-    std_y = np.std(ys)
-    if std_x / (std_y + 1e-6) < 0.3:
-        return "line"
-    if std_y / (std_x + 1e-6) < 0.3:
-        return "line"
-    
-    # グリッド判定: ある程度整列している
-    if std_x > 0 and std_y > 0:
-        # 簡易判定: グリッドっぽい
-        return "grid"
-    
-    return "custom"
-
-
-def calculate_features(positions: Dict[str, Dict[str, float]]) -> Dict[str, float]:
-    """フォーメーションの特徴量を計算"""
-    if len(positions) < 2:
-        return {
-            "symmetry": 0.0,
-            "spread": 0.0,
-            "rotation": 0.0
-        }
-    
-    pos_list = list(positions.values())
-    xs = [p["x"] for p in pos_list]
-    ys = [p["y"] for p in pos_list]
-    
-    # 中心
-    center_x = np.mean(xs)
-    center_y = np.mean(ys)
-    
-    # 散開度（中心からの平均距離）
-    distances = [np.sqrt((p["x"] - center_x)**2 + (p["y"] - center_y)**2) for p in pos_list]
-    spread = np.mean(distances)
-    
-    # 対称性スコア（簡易版: X軸対称性）
-    # 実際にはもっと複雑な計算が必要
-    symmetry = 0.5  # デフォルト値
-    
+class SimilarFormationQuery(BaseModel):
+    positions: Dict[str, Dict[str, float]]  # {memberId: {x, y}}
+    k: int = Field(5, ge=1, le=100)
+    userId: Optional[str] = None  # 指定時はそのユーザーのドリルのみ検索
+    excludeDrillId: Optional[str] = None  # 編集中のドリル自身を除外する場合など
+
+    _validate_positions = field_validator("positions")(_check_positions)
+
+
+PositionsDict = Dict[str, Dict[str, float]]
+
+
+def drill_to_array(
+    positions_list: List[PositionsDict],
+) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    セットごとの positions を (セット数 × メンバー数 × 2) の配列にまとめる
+
+    Returns:
+        member_ids: 配列の2軸目に対応するメンバーID（初出順）
+        coords: 座標配列。そのセットにいないメンバーは NaN
+        valid: (セット数 × メンバー数) の在籍マスク
+    """
+    member_index: Dict[str, int] = {}
+    rows: List[int] = []
+    cols: List[int] = []
+    xs: List[float] = []
+    ys: List[float] = []
+    for i, positions in enumerate(positions_list):
+        for member_id, p in positions.items():
+            j = member_index.get(member_id)
+            if j is None:
+                j = member_index[member_id] = len(member_index)
+            cols.append(j)
+            xs.append(p["x"])
+            ys.append(p["y"])
+        rows.extend([i] * len(positions))
+
+    coords = np.full((len(positions_list), len(member_index), 2), np.nan)
+    coords[rows, cols, 0] = xs
+    coords[rows, cols, 1] = ys
+
+    return list(member_index), coords, ~np.isnan(coords[..., 0])
+
+
+def _masked_mean_std(values: np.ndarray, valid: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """最終軸方向の平均と標準偏差（validがFalseの要素は無視）"""
+    denom = np.maximum(counts, 1)
+    filled = np.where(valid, values, 0.0)
+    mean = filled.sum(axis=-1) / denom
+    var = np.where(valid, (values - mean[..., None]) ** 2, 0.0).sum(axis=-1) / denom
+    return mean, np.sqrt(var)
+
+
+def _set_geometry(coords: np.ndarray, valid: np.ndarray) -> Dict[str, np.ndarray]:
+    """各セットの中心・中心からの距離・XY方向のばらつきを一括計算"""
+    counts = valid.sum(axis=1)
+    _, std_x = _masked_mean_std(coords[..., 0], valid, counts)
+    _, std_y = _masked_mean_std(coords[..., 1], valid, counts)
+    center = np.where(valid[..., None], coords, 0.0).sum(axis=1) / np.maximum(counts, 1)[:, None]
+    distances = np.hypot(coords[..., 0] - center[:, None, 0], coords[..., 1] - center[:, None, 1])
+    avg_distance, std_distance = _masked_mean_std(distances, valid, counts)
     return {
-        "symmetry": float(symmetry),
-        "spread": float(spread),
-        "rotation": 0.0
+        "counts": counts,
+        "avg_distance": avg_distance,
+        "std_distance": std_distance,
+        "std_x": std_x,
+        "std_y": std_y,
     }
 
 
+def calculate_formation_types(coords: np.ndarray, valid: np.ndarray) -> List[str]:
+    """全セットのフォーメーションタイプを一括判定"""
+    return _formation_types_from_geometry(_set_geometry(coords, valid))
+
+
+def _formation_types_from_geometry(g: Dict[str, np.ndarray]) -> List[str]:
+    std_x, std_y = g["std_x"], g["std_y"]
+    conditions = [
+        g["counts"] < 3,
+        # 円形判定: 距離のばらつきが小さい
+        g["std_distance"] / (g["avg_distance"] + 1e-6) < 0.3,
+        # 直線判定: XまたはYのばらつきが小さい
+        (std_x / (std_y + 1e-6) < 0.3) | (std_y / (std_x + 1e-6) < 0.3),
+        # グリッド判定: ある程度整列している（簡易判定）
+        (std_x > 0) & (std_y > 0),
+    ]
+    choices = ["custom", "circle", "line", "grid"]
+    return np.select(conditions, choices, default="custom").tolist()
+
+
+def calculate_features_batch(coords: np.ndarray, valid: np.ndarray) -> List[Dict[str, float]]:
+    """全セットの特徴量を一括計算"""
+    return _features_from_geometry(_set_geometry(coords, valid))
+
+
+def _features_from_geometry(g: Dict[str, np.ndarray]) -> List[Dict[str, float]]:
+    # 散開度（中心からの平均距離）。メンバーが2人未満のセットは0
+    spreads = np.where(g["counts"] < 2, 0.0, g["avg_distance"])
+    # 対称性スコアは簡易版（デフォルト値）。実際にはもっと複雑な計算が必要
+    return [
+        {
+            "symmetry": 0.0 if count < 2 else 0.5,
+            "spread": float(spread),
+            "rotation": 0.0
+        }
+        for count, spread in zip(g["counts"].tolist(), spreads.tolist())
+    ]
+
+
+def calculate_transitions(
+    coords: np.ndarray,
+    valid: np.ndarray,
+    durations: List[float],
+) -> List[Transition]:
+    """連続するセット間の遷移を一括計算（fromSetId / toSetId は呼び出し側で設定）"""
+    if len(coords) < 2:
+        return []
+
+    # 両方のセットにいる（共通）メンバーの移動距離
+    common = valid[1:] & valid[:-1]
+    delta = coords[1:] - coords[:-1]
+    distances = np.where(common, np.hypot(delta[..., 0], delta[..., 1]), 0.0)
+    common_counts = common.sum(axis=1)
+    max_distances = distances.max(axis=1, initial=0.0)
+    avg_distances = distances.sum(axis=1) / np.maximum(common_counts, 1)
+
+    # 移動タイプ判定
+    movement_types = np.select(
+        [avg_distances < 2.0, avg_distances < 5.0],
+        ["static", "smooth"],
+        default="expand",  # 簡易判定
+    )
+
+    transitions = []
+    for i, duration in enumerate(durations):
+        if common_counts[i] == 0:
+            transitions.append(Transition(
+                fromSetId="",
+                toSetId="",
+                duration=duration,
+                movementType="unknown"
+            ))
+            continue
+        transitions.append(Transition(
+            fromSetId="",
+            toSetId="",
+            duration=duration,
+            movementType=str(movement_types[i]),
+            maxDistance=float(max_distances[i]),
+            avgDistance=float(avg_distances[i]),
+            rotation=0.0
+        ))
+    return transitions
+
+
+def calculate_formation_type(positions: PositionsDict) -> str:
+    """フォーメーションタイプを判定"""
+    _, coords, valid = drill_to_array([positions])
+    return calculate_formation_types(coords, valid)[0]
+
+
+def calculate_features(positions: PositionsDict) -> Dict[str, float]:
+    """フォーメーションの特徴量を計算"""
+    _, coords, valid = drill_to_array([positions])
+    return calculate_features_batch(coords, valid)[0]
+
+
 def calculate_transition(
-    from_positions: Dict[str, Dict[str, float]],
-    to_positions: Dict[str, Dict[str, float]],
+    from_positions: PositionsDict,
+    to_positions: PositionsDict,
     duration: float
 ) -> Transition:
     """セット間の遷移を計算"""
-    # 共通メンバーの移動距離を計算
-    common_members = set(from_positions.keys()) & set(to_positions.keys())
-    
-    if not common_members:
-        return Transition(
-            fromSetId="",
-            toSetId="",
-            duration=duration,
-            movementType="unknown"
-        )
-    
-    distances = []
-    for member_id in common_members:
-        from_pos = from_positions[member_id]
-        to_pos = to_positions[member_id]
-        dist = np.sqrt(
-            (to_pos["x"] - from_pos["x"])**2 +
-            (to_pos["y"] - from_pos["y"])**2
-        )
-        distances.append(dist)
-    
-    max_distance = float(np.max(distances)) if distances else 0.0
-    avg_distance = float(np.mean(distances)) if distances else 0.0
-    
-    # 移動タイプ判定
-    if avg_distance < 2.0:
-        movement_type = "static"
-    elif avg_distance < 5.0:
-        movement_type = "smooth"
-    else:
-        movement_type = "expand"  # 簡易判定
-    
-    return Transition(
-        fromSetId="",
-        toSetId="",
-        duration=duration,
-        movementType=movement_type,
-        maxDistance=max_distance,
-        avgDistance=avg_distance,
-        rotation=0.0
-    )
+    _, coords, valid = drill_to_array([from_positions, to_positions])
+    return calculate_transitions(coords, valid, [duration])[0]
 
 
-def save_drill_for_learning(drill_data: DrillData) -> Dict[str, Any]:
-    """ドリルデータを学習用に保存"""
+def prepare_drill_for_learning(drill_data: DrillData) -> Dict[str, Any]:
+    """特徴量・遷移を計算し、ストアに保存する形式（dict）に変換"""
+    sets = drill_data.sets
+
+    # ドリル全体を1つの配列に変換し、全セット分をまとめて計算
+    _, coords, valid = drill_to_array([s.positions for s in sets])
+    geometry = _set_geometry(coords, valid)
+    formation_types = _formation_types_from_geometry(geometry)
+    features = _features_from_geometry(geometry)
+    descriptors = compute_descriptors(coords, valid)
+    durations = [sets[i + 1].startCount - sets[i].startCount for i in range(len(sets) - 1)]
+    transitions = calculate_transitions(coords, valid, durations)
+
     # セットにフォーメーションタイプと特徴量を追加
-    processed_sets = []
-    for i, set_data in enumerate(drill_data.sets):
-        formation_type = calculate_formation_type(set_data.positions)
-        features = calculate_features(set_data.positions)
-        
-        processed_set = DrillSet(
-            **set_data.dict(),
-            formationType=formation_type,
-            features=features
-        )
-        processed_sets.append(processed_set)
-    
-    # 遷移を計算
-    transitions = []
-    for i in range(len(processed_sets) - 1):
-        from_set = processed_sets[i]
-        to_set = processed_sets[i + 1]
-        duration = to_set.startCount - from_set.startCount
-        
-        transition = calculate_transition(
-            from_set.positions,
-            to_set.positions,
-            duration
-        )
-        transition.fromSetId = from_set.id
-        transition.toSetId = to_set.id
-        transitions.append(transition)
-    
-    # 保存
-    drill_data.sets = processed_sets
+    for set_data, formation_type, set_features, descriptor in zip(sets, formation_types, features, descriptors):
+        set_data.formationType = formation_type
+        set_data.features = set_features
+        set_data.descriptor = descriptor.tolist()
+
+    for i, transition in enumerate(transitions):
+        transition.fromSetId = sets[i].id
+        transition.toSetId = sets[i + 1].id
+
     drill_data.transitions = transitions
-    
-    # ファイルに保存
-    file_path = LEARNING_DATA_DIR / f"{drill_data.drillId}.json"
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(drill_data.dict(), f, ensure_ascii=False, indent=2)
-    
+    return drill_data.dict()
+
+
+def save_drill_for_learning(drill_data: DrillData) -> Dict[str, Any]:
+    """ドリルデータを学習用に保存（同期版。APIからは app.writer 経由で非同期に保存する）"""
+    record = prepare_drill_for_learning(drill_data)
+    get_learning_store().save_drill(record, resolve_user_id(record))
+
     return {
         "success": True,
         "drillId": drill_data.drillId,
-        "patternsExtracted": len(transitions),
+        "patternsExtracted": len(record["transitions"]),
         "message": "ドリルを学習データとして保存しました"
     }
 
 
+# 統計キャッシュ: user_id → (ストアの世代番号, 統計)。書き込みバッチごとに無効化される
+# （世代番号を持たないストア、つまりファイルストアではキャッシュせず毎回集計する）
+_statistics_cache: Dict[Optional[str], Tuple[int, Dict[str, Any]]] = {}
+_statistics_cache_lock = threading.Lock()
+
+
 def load_learned_patterns(user_id: Optional[str] = None) -> Dict[str, Any]:
-    """学習済みパターンを読み込み"""
-    # 簡易版: 全ドリルを読み込んで統計を計算
-    drills = []
-    for file_path in LEARNING_DATA_DIR.glob("*.json"):
-        try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                drill_data = json.load(f)
-                drills.append(drill_data)
-        except Exception:
-            continue
-    
-    if not drills:
-        return {
-            "patterns": [],
-            "sectionPreferences": {},
-            "statistics": {
-                "totalDrills": 0,
-                "totalSets": 0,
-                "avgSetsPerDrill": 0
-            }
-        }
-    
-    # 統計を計算
-    total_sets = sum(len(d["sets"]) for d in drills)
-    formation_counts = {}
-    transition_counts = {}
-    section_stats = {}
-    
-    for drill in drills:
-        for set_data in drill.get("sets", []):
-            formation = set_data.get("formationType", "custom")
-            formation_counts[formation] = formation_counts.get(formation, 0) + 1
-            
-            section = set_data.get("section")
-            if section:
-                if section not in section_stats:
-                    section_stats[section] = {
-                        "count": 0,
-                        "formations": {},
-                        "avgMovementDistance": []
-                    }
-                section_stats[section]["count"] += 1
-                section_stats[section]["formations"][formation] = \
-                    section_stats[section]["formations"].get(formation, 0) + 1
-        
-        for transition in drill.get("transitions", []):
-            movement_type = transition.get("movementType", "unknown")
-            transition_counts[movement_type] = transition_counts.get(movement_type, 0) + 1
-            
-            section = transition.get("section")
-            if section and section in section_stats:
-                avg_dist = transition.get("avgDistance", 0)
-                if avg_dist > 0:
-                    section_stats[section]["avgMovementDistance"].append(avg_dist)
-    
-    # セクション別の平均移動距離を計算
-    for section in section_stats:
-        distances = section_stats[section]["avgMovementDistance"]
-        if distances:
-            section_stats[section]["avgMovementDistance"] = float(np.mean(distances))
-        else:
-            section_stats[section]["avgMovementDistance"] = 0.0
-    
+    """学習済みパターンを読み込み（user_id指定時はそのユーザーのドリルのみ）"""
+    store = get_learning_store()
+    generation = store.generation()
+    with _statistics_cache_lock:
+        cached = _statistics_cache.get(user_id)
+    if generation is not None and cached is not None and cached[0] == generation:
+        stats = cached[1]
+    else:
+        stats = store.compute_statistics(user_id)
+        if generation is not None:
+            with _statistics_cache_lock:
+                _statistics_cache[user_id] = (generation, stats)
     return {
-        "patterns": [],  # 後で実装
-        "sectionPreferences": section_stats,
-        "statistics": {
-            "totalDrills": len(drills),
-            "totalSets": total_sets,
-            "avgSetsPerDrill": total_sets / len(drills) if drills else 0,
-            "mostUsedFormation": max(formation_counts.items(), key=lambda x: x[1])[0] if formation_counts else None,
-            "mostUsedTransition": max(transition_counts.items(), key=lambda x: x[1])[0] if transition_counts else None
-        }
+        # フォーメーションの提案は /learning/similar（find_similar_formations）で行う。
+        # patterns はレスポンスの形を保つために空のまま返す
+        "patterns": [],
+        **stats,
     }
 
+
+def find_similar_formations(query: SimilarFormationQuery) -> Dict[str, Any]:
+    """形が似ているセットを学習データから検索し、その次の遷移とあわせて返す"""
+    with stage("learning.descriptor"):
+        _, coords, valid = drill_to_array([query.positions])
+        descriptor = compute_descriptors(coords, valid)[0]
+    if not descriptor.any():
+        return {"results": []}
+
+    with stage("learning.similarity_search"):
+        matches = get_formation_index().search(
+            descriptor, k=query.k, user_id=query.userId, exclude_drill_id=query.excludeDrillId
+        )
+    with stage("learning.set_context"):
+        contexts = get_learning_store().get_set_context(
+            [(user_id, drill_id, index) for user_id, drill_id, index, _ in matches]
+        )
+
+    results = []
+    for user_id, drill_id, set_index, score in matches:
+        context = contexts.get((user_id, drill_id, set_index))
+        if context is None:
+            continue
+        results.append({
+            "drillId": drill_id,
+            "userId": user_id,
+            "setIndex": set_index,
+            "score": score,
+            **context,
+        })
+    return {"results": results}
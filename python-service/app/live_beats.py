@@ -0,0 +1,198 @@
+"""
+リアルタイムのビート検出（WebSocket /music/stream 用）
+
+PCM音声を小さなチャンクで受け取り、オンセット強度（スペクトルフラックス）を逐次計算して
+直近 window_seconds 分だけリングバッファに保持する。新しい音声が analysis_interval 秒分
+たまるごとに、そのバッファに対してビート検出（librosaがあれば beat_track、なければ
+自己相関による簡易推定）を行い、まだ通知していないビートと推定BPMを返す。
+1回の解析にかかる時間はバッファ長で頭打ちになるため、ストリームが長くなっても遅延は一定。
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.observability import stage
+
+
+LIVE_WINDOW_SECONDS = 8.0  # ビート検出に使う直近の長さ
+LIVE_MIN_SECONDS = 2.0  # 解析を始めるのに必要な長さ
+LIVE_ANALYSIS_INTERVAL = 0.5  # 解析間隔（音声の秒数）
+LIVE_N_FFT = 2048
+LIVE_HOP_LENGTH = 512
+LIVE_BPM_RANGE = (60.0, 200.0)
+LIVE_BPM_SMOOTHING = 0.3  # BPMの指数移動平均の係数（新しい推定値の重み）
+# オンセット強度のフレーム k は窓 [k*hop, k*hop + n_fft) から計算するため、音の立ち上がりより前の時刻になる。
+# 窓の中心（n_fft/2、librosaの center=True と同じ考え方）に加え、対数圧縮したハン窓では
+# 立ち上がりが窓の後半に入った時点でフラックスが最大になるので、クリック音で測った値（窓長の0.75倍）だけずらす
+LIVE_ONSET_LAG = 0.75
+
+SAMPLE_FORMATS = {
+    "f32le": np.dtype("<f4"),
+    "s16le": np.dtype("<i2"),
+}
+
+
+def decode_pcm(data: bytes, sample_format: str, channels: int) -> np.ndarray:
+    """PCMバイト列をモノラルの float32 配列（-1〜1）に変換"""
+    dtype = SAMPLE_FORMATS[sample_format]
+    usable = len(data) - len(data) % (dtype.itemsize * channels)
+    samples = np.frombuffer(data[:usable], dtype=dtype)
+    if dtype.kind == "i":
+        samples = samples.astype(np.float32) / np.iinfo(dtype).max
+    else:
+        samples = samples.astype(np.float32, copy=False)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+def _estimate_beats_numpy(envelope: np.ndarray, frame_rate: float) -> tuple[float, np.ndarray]:
+    """自己相関でテンポを推定し、ビート位置（フレーム番号、小数）を返す（librosaなし用）"""
+    env = envelope - envelope.mean()
+    min_lag = max(1, int(round(frame_rate * 60.0 / LIVE_BPM_RANGE[1])))
+    max_lag = min(len(env) // 2, int(round(frame_rate * 60.0 / LIVE_BPM_RANGE[0])))
+    if max_lag <= min_lag or not env.any():
+        return 0.0, np.array([], dtype=np.float64)
+
+    spectrum = np.fft.rfft(env, n=2 * len(env))
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum))[:len(env)]
+    lags = np.arange(min_lag, max_lag + 1)
+    # 120BPM付近を優先する対数正規の重み（librosa と同じ考え方）
+    bpms = 60.0 * frame_rate / lags
+    prior = np.exp(-0.5 * (np.log2(bpms / 120.0)) ** 2)
+    weighted = autocorr[lags] * prior
+    best = int(np.argmax(weighted))
+    period = float(lags[best])
+    # 放物線補間で周期を小数精度にする（フレーム単位の丸めによるBPMのずれを抑える）
+    if 0 < best < len(lags) - 1:
+        left, center, right = weighted[best - 1:best + 2]
+        denom = left - 2 * center + right
+        if denom < 0:
+            period += 0.5 * (left - right) / denom
+
+    # 位相: ビート格子上のオンセット強度の平均が最大になるオフセット。
+    # フレーム単位（hop_length / sr、22050Hzで約23ms）に丸めるとビート時刻がずれるため、1/4フレーム刻みで探す
+    frames = np.arange(len(envelope))
+    positions = np.arange(0.0, len(envelope) - 1, period)
+    offsets = np.arange(0.0, period, 0.25)
+    phase_scores = np.interp(positions[None, :] + offsets[:, None], frames, envelope).mean(axis=1)
+    offset = float(offsets[int(np.argmax(phase_scores))])
+    beats = np.arange(offset, len(envelope) - 1, period)
+    return 60.0 * frame_rate / period, beats
+
+
+class LiveBeatTracker:
+    """1ストリーム分の状態（音声の端数、オンセット強度のリングバッファ、通知済みビート）"""
+
+    def __init__(
+        self,
+        sample_rate: int,
+        librosa_module: Any = None,
+        start_time: float = 0.0,
+        window_seconds: float = LIVE_WINDOW_SECONDS,
+        analysis_interval: float = LIVE_ANALYSIS_INTERVAL,
+        n_fft: int = LIVE_N_FFT,
+        hop_length: int = LIVE_HOP_LENGTH,
+    ):
+        self.sample_rate = sample_rate
+        self.librosa = librosa_module
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.frame_rate = sample_rate / hop_length
+        self._frame_offset = LIVE_ONSET_LAG * n_fft / sample_rate  # フレーム番号→時刻の補正（秒）
+        self._window = np.hanning(n_fft).astype(np.float32)
+        self._capacity = int(window_seconds * self.frame_rate)
+        self._min_frames = int(LIVE_MIN_SECONDS * self.frame_rate)
+        self._interval_frames = max(1, int(analysis_interval * self.frame_rate))
+        self.reset(start_time)
+
+    def reset(self, start_time: float = 0.0) -> None:
+        """状態を破棄する（録音の再生位置を移動した場合など）"""
+        self.start_time = start_time
+        self._audio = np.zeros(0, dtype=np.float32)
+        self._prev_spectrum: Optional[np.ndarray] = None
+        self._envelope = np.zeros(self._capacity, dtype=np.float32)
+        self._env_len = 0
+        self._frames_total = 0
+        self._last_analysis_frame = 0
+        self._last_beat: Optional[float] = None
+        self.bpm: Optional[float] = None
+
+    @property
+    def current_time(self) -> float:
+        """これまでに受け取った音声の長さ（ストリーム上の時刻）"""
+        # 解析済みフレームの先頭位置までの長さに、まだフレームにしていない端数を加える
+        samples = self._frames_total * self.hop_length + len(self._audio)
+        return self.start_time + samples / self.sample_rate
+
+    def push(self, samples: np.ndarray) -> Optional[Dict[str, Any]]:
+        """音声を追加し、解析を行った場合は新しいビートとBPMを返す"""
+        self._append_onsets(samples)
+        if self._env_len < self._min_frames:
+            return None
+        if self._frames_total - self._last_analysis_frame < self._interval_frames:
+            return None
+        self._last_analysis_frame = self._frames_total
+        with stage("music.live_analyze"):
+            return self._analyze()
+
+    def _append_onsets(self, samples: np.ndarray) -> None:
+        audio = np.concatenate([self._audio, samples]) if len(self._audio) else samples
+        if len(audio) < self.n_fft:
+            self._audio = audio
+            return
+        n_frames = 1 + (len(audio) - self.n_fft) // self.hop_length
+        frames = np.lib.stride_tricks.sliding_window_view(audio, self.n_fft)[::self.hop_length][:n_frames]
+        spectrum = np.log1p(100.0 * np.abs(np.fft.rfft(frames * self._window, axis=1)))
+
+        # スペクトルフラックス（増加分のみ）の平均をオンセット強度とする
+        previous = spectrum[:1] if self._prev_spectrum is None else self._prev_spectrum[None, :]
+        flux = np.maximum(np.diff(np.vstack([previous, spectrum]), axis=0), 0.0).mean(axis=1)
+        self._prev_spectrum = spectrum[-1]
+        self._audio = audio[n_frames * self.hop_length:]
+
+        # リングバッファ（古い順に並べた固定長配列）に追加
+        flux = flux[-self._capacity:].astype(np.float32)
+        keep = min(self._env_len, self._capacity - len(flux))
+        self._envelope[:keep] = self._envelope[self._env_len - keep:self._env_len]
+        self._envelope[keep:keep + len(flux)] = flux
+        self._env_len = keep + len(flux)
+        self._frames_total += n_frames
+
+    def _analyze(self) -> Optional[Dict[str, Any]]:
+        envelope = self._envelope[:self._env_len]
+        first_frame = self._frames_total - self._env_len
+
+        bpm = 0.0
+        beat_frames = np.array([], dtype=np.int64)
+        if self.librosa is not None:
+            try:
+                tempo, beat_frames = self.librosa.beat.beat_track(
+                    onset_envelope=envelope, sr=self.sample_rate, hop_length=self.hop_length
+                )
+                bpm = float(np.atleast_1d(tempo)[0])
+            except Exception:
+                bpm = 0.0
+        if bpm <= 0:
+            bpm, beat_frames = _estimate_beats_numpy(envelope, self.frame_rate)
+        if bpm <= 0:
+            return None
+
+        self.bpm = bpm if self.bpm is None else (1 - LIVE_BPM_SMOOTHING) * self.bpm + LIVE_BPM_SMOOTHING * bpm
+        period = 60.0 / bpm
+        beat_times = self.start_time + (first_frame + np.asarray(beat_frames)) / self.frame_rate + self._frame_offset
+
+        # 通知済みのビートと半拍以内のものは同じビートとみなして除外
+        new_beats: List[float] = []
+        for t in beat_times.tolist():
+            if self._last_beat is None or t > self._last_beat + period / 2:
+                new_beats.append(round(t, 4))
+                self._last_beat = t
+
+        return {
+            "type": "beats",
+            "beats": new_beats,
+            "bpm": round(self.bpm, 2),
+            "bpmRaw": round(bpm, 2),
+            "time": round(self.current_time, 4),
+        }
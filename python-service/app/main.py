@@ -1,12 +1,36 @@
+import asyncio
 import io
+import json
+import logging
 import tempfile
 import os
+import threading
+import time
 from typing import Optional
 
 import numpy as np
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 
+from app.live_beats import SAMPLE_FORMATS, LiveBeatTracker, decode_pcm
+from app.observability import (
+    REQUEST_DURATION,
+    begin_request,
+    configure_logging,
+    end_request,
+    log_fields,
+    register_gauge,
+    render_metrics,
+    server_timing_header,
+    stage,
+)
+from app.responses import FastJSONResponse
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # librosaの条件付きインポート（Python 3.14未対応のため）
 try:
     import librosa
@@ -15,7 +39,32 @@ except ImportError:
     LIBROSA_AVAILABLE = False
     librosa = None
 
-app = FastAPI(title="Drill Python Service", version="0.1.0")
+app = FastAPI(title="Drill Python Service", version="0.1.0", default_response_class=FastJSONResponse)
+
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """リクエスト全体とステージごとの所要時間を記録し、Server-Timing ヘッダーを付与する"""
+    timings, token = begin_request()
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+    finally:
+        elapsed = time.perf_counter() - started
+        end_request(token)
+        # ラベルの種類が増えすぎないよう、パスではなくルートのテンプレートを使う
+        route = request.scope.get("route")
+        REQUEST_DURATION.observe(elapsed, request.method, getattr(route, "path", "unmatched"), status)
+    response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Prometheusテキスト形式のメトリクス"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 
 # ==================== 音楽分析 ====================
@@ -33,7 +82,8 @@ class MusicAnalysisResult(BaseModel):
 def _analyze_music_quick(file_path: str) -> MusicAnalysisResult:
     """簡易版: 冒頭30秒のみでBPM検出（高速）"""
     # サンプリングレートを下げて、モノラルで読み込み
-    y, sr = librosa.load(file_path, sr=22050, mono=True, duration=30.0)  # 冒頭30秒のみ
+    with stage("music.decode"):
+        y, sr = librosa.load(file_path, sr=22050, mono=True, duration=30.0)  # 冒頭30秒のみ
     
     # BPM検出（複数の方法を試す）
     bpm = 120.0  # デフォルト値
@@ -41,7 +91,8 @@ def _analyze_music_quick(file_path: str) -> MusicAnalysisResult:
     
     try:
         # 方法1: beat_trackを使用
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units="time")
+        with stage("music.beat_track"):
+            tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units="time")
         if tempo > 0:
             bpm = float(tempo)
         else:
@@ -60,8 +111,8 @@ def _analyze_music_quick(file_path: str) -> MusicAnalysisResult:
                         median_interval = np.median(intervals[intervals > 0])
                         if median_interval > 0:
                             bpm = 60.0 / median_interval
-    except Exception as e:
-        print(f"[WARNING] BPM検出に失敗、デフォルト値を使用: {e}")
+    except Exception:
+        logger.warning("BPM検出に失敗、デフォルト値を使用", exc_info=True, extra=log_fields(file=file_path))
     
     # ビートが空の場合は生成
     if len(beats) == 0:
@@ -73,7 +124,8 @@ def _analyze_music_quick(file_path: str) -> MusicAnalysisResult:
     time_signature = "4/4"
     
     # 実際のファイル長を取得（解析は30秒だけど、全体の長さは記録）
-    full_duration = librosa.get_duration(path=file_path)
+    with stage("music.duration"):
+        full_duration = librosa.get_duration(path=file_path)
     
     return MusicAnalysisResult(
         bpm=bpm,
@@ -89,7 +141,8 @@ def _analyze_music_quick(file_path: str) -> MusicAnalysisResult:
 def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
     """高精度版: 全曲を解析、テンポ変化・セクション検出"""
     # サンプリングレートを下げて、モノラルで読み込み
-    y, sr = librosa.load(file_path, sr=22050, mono=True)
+    with stage("music.decode"):
+        y, sr = librosa.load(file_path, sr=22050, mono=True)
     duration = librosa.get_duration(y=y, sr=sr)
 
     # BPM検出（複数の方法を試す）
@@ -98,7 +151,8 @@ def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
     
     try:
         # 方法1: beat_trackを使用
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units="time")
+        with stage("music.beat_track"):
+            tempo, beats = librosa.beat.beat_track(y=y, sr=sr, units="time")
         if tempo > 0:
             bpm = float(tempo)
         else:
@@ -117,8 +171,8 @@ def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
                         median_interval = np.median(intervals[intervals > 0])
                         if median_interval > 0:
                             bpm = 60.0 / median_interval
-    except Exception as e:
-        print(f"[WARNING] BPM検出に失敗、デフォルト値を使用: {e}")
+    except Exception:
+        logger.warning("BPM検出に失敗、デフォルト値を使用", exc_info=True, extra=log_fields(file=file_path))
     
     # ビートが空の場合は生成
     if len(beats) == 0:
@@ -128,39 +182,40 @@ def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
     # テンポ変化検出（時間窓ごとにテンポを計算）
     tempo_changes = []
     try:
-        # 10秒ごとにテンポを計算
-        window_size = 10.0  # 秒
-        hop_size = 5.0  # 秒（オーバーラップ）
+        with stage("music.tempo_windows"):
+            # 10秒ごとにテンポを計算
+            window_size = 10.0  # 秒
+            hop_size = 5.0  # 秒（オーバーラップ）
         
-        current_time = 0.0
-        while current_time < duration:
-            end_time = min(current_time + window_size, duration)
-            start_frame = librosa.time_to_frames(current_time, sr=sr)
-            end_frame = librosa.time_to_frames(end_time, sr=sr)
+            current_time = 0.0
+            while current_time < duration:
+                end_time = min(current_time + window_size, duration)
+                start_frame = librosa.time_to_frames(current_time, sr=sr)
+                end_frame = librosa.time_to_frames(end_time, sr=sr)
             
-            if end_frame > start_frame:
-                y_segment = y[start_frame:end_frame]
-                if len(y_segment) > 0:
-                    try:
-                        tempo_seg, _ = librosa.beat.beat_track(y=y_segment, sr=sr, units="time")
-                        if tempo_seg <= 0:
-                            # beat_trackが失敗した場合、tempoを使用
-                            tempo_seg = librosa.beat.tempo(y=y_segment, sr=sr, aggregate=np.median)
-                            if len(tempo_seg) > 0:
-                                tempo_seg = tempo_seg[0]
-                            else:
-                                tempo_seg = bpm  # デフォルト値を使用
-                        tempo_changes.append({
-                            "time": float(current_time),
-                            "bpm": float(tempo_seg) if tempo_seg > 0 else bpm,
-                        })
-                    except Exception:
-                        # このセグメントの検出に失敗した場合はスキップ
-                        pass
+                if end_frame > start_frame:
+                    y_segment = y[start_frame:end_frame]
+                    if len(y_segment) > 0:
+                        try:
+                            tempo_seg, _ = librosa.beat.beat_track(y=y_segment, sr=sr, units="time")
+                            if tempo_seg <= 0:
+                                # beat_trackが失敗した場合、tempoを使用
+                                tempo_seg = librosa.beat.tempo(y=y_segment, sr=sr, aggregate=np.median)
+                                if len(tempo_seg) > 0:
+                                    tempo_seg = tempo_seg[0]
+                                else:
+                                    tempo_seg = bpm  # デフォルト値を使用
+                            tempo_changes.append({
+                                "time": float(current_time),
+                                "bpm": float(tempo_seg) if tempo_seg > 0 else bpm,
+                            })
+                        except Exception:
+                            # このセグメントの検出に失敗した場合はスキップ
+                            pass
             
-            current_time += hop_size
-    except Exception as e:
-        print(f"[WARNING] テンポ変化検出に失敗: {e}")
+                current_time += hop_size
+    except Exception:
+        logger.warning("テンポ変化検出に失敗", exc_info=True, extra=log_fields(file=file_path))
         tempo_changes = None
 
     # 拍子検出（簡易版：4/4拍子を仮定、後で改善可能）
@@ -170,9 +225,11 @@ def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
     sections = None
     try:
         # 特徴量を抽出（chroma特徴量を使用）
-        chroma = librosa.feature.chroma_stft(y=y, sr=sr)
+        with stage("music.chroma"):
+            chroma = librosa.feature.chroma_stft(y=y, sr=sr)
         # セグメント検出（特徴量から境界を検出）
-        boundaries = librosa.segment.agglomerative(chroma, k=5)
+        with stage("music.segment"):
+            boundaries = librosa.segment.agglomerative(chroma, k=5)
         section_times = librosa.frames_to_time(boundaries, sr=sr)
         sections = [
             {
@@ -182,8 +239,8 @@ def _analyze_music_full(file_path: str) -> MusicAnalysisResult:
             }
             for i in range(len(section_times))
         ]
-    except Exception as e:
-        print(f"[WARNING] セクション検出に失敗: {e}")
+    except Exception:
+        logger.warning("セクション検出に失敗", exc_info=True, extra=log_fields(file=file_path))
 
     return MusicAnalysisResult(
         bpm=bpm,
@@ -230,7 +287,7 @@ def _analyze_music_fallback(file_path: str, mode: str = "quick") -> MusicAnalysi
 async def analyze_music(
     file: UploadFile = File(...),
     mode: str = Form("quick"),  # "quick" or "full"
-) -> MusicAnalysisResult:
+) -> FastJSONResponse:
     """
     音楽ファイルを解析してBPM、ビート、拍子などを検出する。
     
@@ -240,6 +297,13 @@ async def analyze_music(
         file: 音楽ファイル
         mode: "quick" (冒頭30秒のみ、高速) または "full" (全曲解析、テンポ変化検出)
     """
+    result = await _run_music_analysis(file, mode)
+    # 解析結果は組み立て時に検証済みのため、response_model による再検証を省いて返す
+    return FastJSONResponse(result.dict())
+
+
+async def _run_music_analysis(file: UploadFile, mode: str) -> MusicAnalysisResult:
+    """アップロードされた音楽ファイルを一時ファイルに保存して解析"""
     if mode not in ["quick", "full"]:
         raise HTTPException(status_code=400, detail='modeは"quick"または"full"である必要があります')
     
@@ -252,10 +316,12 @@ async def analyze_music(
         # アップロードされたファイルを一時ファイルに保存
         suffix = f".{file.filename.split('.')[-1]}" if '.' in file.filename else ""
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            content = await file.read()
+            with stage("music.upload"):
+                content = await file.read()
             if len(content) == 0:
                 raise HTTPException(status_code=400, detail="空のファイルです")
-            tmp_file.write(content)
+            with stage("music.temp_write"):
+                tmp_file.write(content)
             tmp_file_path = tmp_file.name
 
         # librosaが使える場合は高精度解析、そうでない場合はフォールバック
@@ -265,12 +331,18 @@ async def analyze_music(
                     result = _analyze_music_quick(tmp_file_path)
                 else:
                     result = _analyze_music_full(tmp_file_path)
-            except Exception as e:
+            except Exception:
                 # librosaでの解析に失敗した場合、フォールバックを試す
-                print(f"[WARNING] librosa解析に失敗、フォールバックを使用: {e}")
-                result = _analyze_music_fallback(tmp_file_path, mode)
+                logger.warning(
+                    "librosa解析に失敗、フォールバックを使用",
+                    exc_info=True,
+                    extra=log_fields(upload_name=file.filename, mode=mode),
+                )
+                with stage("music.fallback"):
+                    result = _analyze_music_fallback(tmp_file_path, mode)
         else:
-            result = _analyze_music_fallback(tmp_file_path, mode)
+            with stage("music.fallback"):
+                result = _analyze_music_fallback(tmp_file_path, mode)
 
         return result
 
@@ -311,7 +383,7 @@ async def generate_music_markers(
     """
     try:
         # 音楽解析を実行
-        analysis = await analyze_music(file)
+        analysis = await _run_music_analysis(file, "quick")
         bpm = analysis.bpm
 
         # マーカーを生成
@@ -344,6 +416,113 @@ async def generate_music_markers(
         raise HTTPException(status_code=400, detail=f"マーカー生成エラー: {str(e)}")
 
 
+LIVE_MAX_STREAMS = 16  # 1ワーカーあたりの同時ストリーム数
+LIVE_MAX_CHUNK_SECONDS = 5.0  # 1メッセージあたりの最大音声長
+_live_streams = 0
+
+
+def _as_number(value) -> Optional[float]:
+    """JSONの数値を float に変換（数値でない・真偽値・有限でない場合は None）"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    try:
+        number = float(value)
+    except OverflowError:
+        return None
+    return number if np.isfinite(number) else None
+
+
+def _as_int(value) -> Optional[int]:
+    """JSONの整数を int に変換（44100.0 のような整数値の小数も可、それ以外は None）"""
+    number = _as_number(value)
+    return int(number) if number is not None and number.is_integer() else None
+
+
+@app.websocket("/music/stream")
+async def stream_beats(websocket: WebSocket) -> None:
+    """
+    ライブ音声（PCM）を受け取り、ビート位置と推定BPMを逐次返す。
+
+    プロトコル:
+        1. クライアント → テキスト: {"sample_rate": 44100, "format": "f32le" | "s16le", "channels": 1}
+           （省略時は 22050Hz / f32le / モノラル）。サーバー → {"type": "ready", ...}
+        2. クライアント → バイナリ: PCMチャンク（数十〜数百ミリ秒程度）
+           サーバー → {"type": "beats", "beats": [秒, ...], "bpm": 平滑化BPM, "bpmRaw": 今回の推定, "time": 受信済みの長さ}
+        3. クライアント → テキスト: {"type": "reset", "time": 再生位置(秒)} で状態をリセット（録音のシーク時など）
+    """
+    global _live_streams
+    await websocket.accept()
+    if _live_streams >= LIVE_MAX_STREAMS:
+        await websocket.send_json({"type": "error", "detail": "同時接続数の上限に達しています"})
+        await websocket.close(code=1013)
+        return
+    _live_streams += 1
+
+    sample_rate, sample_format, channels = 22050, "f32le", 1
+    tracker: Optional[LiveBeatTracker] = None
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("text") is not None:
+                try:
+                    command = json.loads(message["text"])
+                except ValueError:
+                    await websocket.send_json({"type": "error", "detail": "JSONを解析できません"})
+                    continue
+                if not isinstance(command, dict):
+                    await websocket.send_json({"type": "error", "detail": "JSONオブジェクトを送ってください"})
+                    continue
+                if command.get("type") == "reset":
+                    start_time = _as_number(command.get("time", 0.0))
+                    if start_time is None or start_time < 0:
+                        await websocket.send_json({"type": "error", "detail": "time は0以上の数値で指定してください"})
+                        continue
+                    if tracker is not None:
+                        tracker.reset(start_time)
+                    continue
+                if tracker is not None:
+                    await websocket.send_json({"type": "error", "detail": "設定はストリーム開始前に送ってください"})
+                    continue
+                sample_rate = _as_int(command.get("sample_rate", sample_rate))
+                sample_format = command.get("format", sample_format)
+                channels = _as_int(command.get("channels", channels))
+                if (
+                    not isinstance(sample_format, str) or sample_format not in SAMPLE_FORMATS
+                    or sample_rate is None or not 8000 <= sample_rate <= 192000
+                    or channels is None or not 1 <= channels <= 8
+                ):
+                    await websocket.send_json({"type": "error", "detail": "sample_rate / format / channels が不正です"})
+                    await websocket.close(code=1003)
+                    break
+                tracker = LiveBeatTracker(sample_rate, librosa if LIBROSA_AVAILABLE else None)
+                await websocket.send_json({
+                    "type": "ready",
+                    "sample_rate": sample_rate,
+                    "format": sample_format,
+                    "channels": channels,
+                })
+                continue
+
+            data = message.get("bytes") or b""
+            if tracker is None:
+                tracker = LiveBeatTracker(sample_rate, librosa if LIBROSA_AVAILABLE else None)
+            samples = decode_pcm(data, sample_format, channels)
+            if len(samples) > LIVE_MAX_CHUNK_SECONDS * sample_rate:
+                await websocket.send_json({"type": "error", "detail": "チャンクが大きすぎます"})
+                continue
+            # 解析はスレッドプールで行い、他のストリームやリクエストを止めない
+            event = await run_in_threadpool(tracker.push, samples)
+            if event is not None:
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        _live_streams -= 1
+
+
 # ==================== フォーメーション生成 ====================
 
 class FormationRequest(BaseModel):
@@ -366,45 +545,55 @@ class FormationResult(BaseModel):
 
 
 @app.post("/formation/generate", response_model=FormationResult)
-async def generate_formation(request: FormationRequest) -> FormationResult:
+async def generate_formation(request: FormationRequest) -> FastJSONResponse:
     """
     指定した条件から最適なフォーメーションを自動生成する。
     
     現在は基本的な形状生成のみ実装。後で最適化アルゴリズムを追加。
     """
-    positions = []
-    member_index = 0
+    with stage("formation.layout"):
+        xs, ys = _layout_formation(request)
+
+    # メンバーごとに Position を作って検証し直すと人数に比例して遅くなるため、
+    # FormationResult と同じ形の dict を直接返す
+    with stage("formation.serialize"):
+        positions = [
+            {"x": x, "y": y, "member_index": i} for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist()))
+        ]
+        return FastJSONResponse({
+            "positions": positions,
+            "shape": request.shape,
+            "total_members": request.member_count,
+        })
+
+
+def _layout_formation(request: FormationRequest) -> tuple[np.ndarray, np.ndarray]:
+    """形状に応じて各メンバーの配置を生成（member_index 順の x, y 座標）"""
+    n = max(request.member_count, 0)
+    index = np.arange(n, dtype=np.float64)
 
     # 形状に応じて配置を生成
     if request.shape == "circle":
         # 円形配置
         radius = min(request.member_count * 0.5, 20.0)
         angle_step = 2 * np.pi / request.member_count
-        for i in range(request.member_count):
-            angle = i * angle_step
-            x = radius * np.cos(angle)
-            y = radius * np.sin(angle)
-            positions.append(Position(x=float(x), y=float(y), member_index=member_index))
-            member_index += 1
+        angles = index * angle_step
+        xs = radius * np.cos(angles)
+        ys = radius * np.sin(angles)
 
     elif request.shape == "line":
         # 直線配置
         spacing = 2.0
         start_x = -(request.member_count - 1) * spacing / 2
-        for i in range(request.member_count):
-            x = start_x + i * spacing
-            positions.append(Position(x=float(x), y=0.0, member_index=member_index))
-            member_index += 1
+        xs = start_x + index * spacing
+        ys = np.zeros(n)
 
     elif request.shape == "v":
         # V字配置
         spacing = 2.0
         center = request.member_count // 2
-        for i in range(request.member_count):
-            x = (i - center) * spacing
-            y = abs(i - center) * 1.5
-            positions.append(Position(x=float(x), y=float(y), member_index=member_index))
-            member_index += 1
+        xs = (index - center) * spacing
+        ys = np.abs(index - center) * 1.5
 
     elif request.shape == "grid":
         # グリッド配置
@@ -413,29 +602,17 @@ async def generate_formation(request: FormationRequest) -> FormationResult:
         spacing = 2.5
         start_x = -(cols - 1) * spacing / 2
         start_y = -(rows - 1) * spacing / 2
-
-        for i in range(request.member_count):
-            row = i // cols
-            col = i % cols
-            x = start_x + col * spacing
-            y = start_y + row * spacing
-            positions.append(Position(x=float(x), y=float(y), member_index=member_index))
-            member_index += 1
+        row, col = np.divmod(np.arange(n), cols)
+        xs = start_x + col * spacing
+        ys = start_y + row * spacing
 
     else:
-        # デフォルト：ランダム配置
+        # デフォルト：ランダム配置（x, y の順に乱数を引くため、メンバーごとに生成した場合と同じ値になる）
         np.random.seed(42)  # 再現性のため
-        for i in range(request.member_count):
-            x = np.random.uniform(-10, 10)
-            y = np.random.uniform(-10, 10)
-            positions.append(Position(x=float(x), y=float(y), member_index=member_index))
-            member_index += 1
-
-    return FormationResult(
-        positions=positions,
-        shape=request.shape,
-        total_members=request.member_count,
-    )
+        xy = np.random.uniform(-10, 10, size=(n, 2))
+        xs, ys = xy[:, 0], xy[:, 1]
+
+    return xs.astype(np.float64), ys.astype(np.float64)
 
 
 # ==================== パス最適化 ====================
@@ -464,45 +641,42 @@ class PathOptimizationResult(BaseModel):
 
 
 @app.post("/path/optimize", response_model=PathOptimizationResult)
-async def optimize_paths(request: PathOptimizationRequest) -> PathOptimizationResult:
+async def optimize_paths(request: PathOptimizationRequest) -> FastJSONResponse:
     """
     現在位置から目標位置への最適な移動経路を計算する。
     
     現在は直線経路のみ。後で衝突回避、速度最適化などを追加。
     """
-    paths = []
-    total_distance = 0.0
-    max_distance = 0.0
-
-    # 各メンバーの経路を計算
-    for i, (current, target) in enumerate(
-        zip(request.current_positions, request.target_positions)
-    ):
-        # 直線経路を生成（簡易版）
-        start_x = current["x"]
-        start_y = current["y"]
-        end_x = target["x"]
-        end_y = target["y"]
-
-        # 距離を計算
-        distance = np.sqrt((end_x - start_x) ** 2 + (end_y - start_y) ** 2)
-        total_distance += distance
-        max_distance = max(max_distance, distance)
-
-        # 経路ポイントを生成（開始点と終了点のみ、後で中間点を追加可能）
-        points = [
-            PathPoint(x=float(start_x), y=float(start_y), time=0.0),
-            PathPoint(x=float(end_x), y=float(end_y), time=1.0),  # 正規化時間
+    with stage("path.compute"):
+        pairs = list(zip(request.current_positions, request.target_positions))
+        start = np.array([(current["x"], current["y"]) for current, _ in pairs], dtype=np.float64).reshape(-1, 2)
+        end = np.array([(target["x"], target["y"]) for _, target in pairs], dtype=np.float64).reshape(-1, 2)
+
+        # 直線経路の距離を全メンバー分まとめて計算
+        distances = np.hypot(end[:, 0] - start[:, 0], end[:, 1] - start[:, 1])
+        total_distance = float(distances.sum())
+        max_distance = float(distances.max()) if len(distances) else 0.0
+
+    # Path / PathPoint をメンバーごとに作らず、PathOptimizationResult と同じ形の dict を直接返す
+    with stage("path.serialize"):
+        paths = [
+            {
+                "member_id": int(current.get("member_id", i)),
+                # 経路ポイント（開始点と終了点のみ、後で中間点を追加可能。時間は正規化）
+                "points": [
+                    {"x": start_x, "y": start_y, "time": 0.0},
+                    {"x": end_x, "y": end_y, "time": 1.0},
+                ],
+            }
+            for i, ((current, _), (start_x, start_y), (end_x, end_y)) in enumerate(
+                zip(pairs, start.tolist(), end.tolist())
+            )
         ]
-
-        member_id = current.get("member_id", i)
-        paths.append(Path(member_id=member_id, points=points))
-
-    return PathOptimizationResult(
-        paths=paths,
-        total_distance=float(total_distance),
-        max_distance=float(max_distance),
-    )
+        return FastJSONResponse({
+            "paths": paths,
+            "total_distance": total_distance,
+            "max_distance": max_distance,
+        })
 
 
 # ==================== ヘルスチェック ====================
@@ -516,6 +690,7 @@ async def health() -> dict:
         "librosa_available": LIBROSA_AVAILABLE,
         "features": [
             "music-analysis",
+            "live-beat-tracking",
             "formation-generation",
             "path-optimization",
         ],
@@ -527,32 +702,178 @@ async def health() -> dict:
 try:
     from app.learning import (
         DrillData,
-        save_drill_for_learning,
+        SimilarFormationQuery,
         load_learned_patterns,
+        find_similar_formations,
     )
+    from app.bulk import ImportLineTooLarge, export_ndjson, import_ndjson
+    from app.similarity import get_formation_index
+    from app.storage import check_drill_key, get_learning_store, resolve_user_id
+    from app.writer import WriterQueueFull, get_learning_writer
     LEARNING_AVAILABLE = True
 except ImportError as e:
     LEARNING_AVAILABLE = False
-    print(f"Learning module not available: {e}")
+    logger.warning("Learning module not available: %s", e)
 
 if LEARNING_AVAILABLE:
+    SAVE_WAIT_TIMEOUT = 30.0  # wait=true のときに書き込みを待つ最大秒数
+
     @app.post("/learning/save-drill")
-    async def save_drill(drill_data: DrillData) -> dict:
-        """ドリルデータを学習用に保存"""
+    async def save_drill(drill_data: DrillData, wait: bool = False) -> dict:
+        """
+        ドリルデータを学習用に保存（書き込みはバックグラウンドで行う）
+
+        通常はキューに追加した時点で応答する（queued: true）。
+        wait=true の場合は書き込みが終わるまで待ち、保存直後の統計を読み直す場合などに使う。
+        """
         try:
-            result = save_drill_for_learning(drill_data)
-            return result
+            with stage("learning.enqueue"):
+                user_id = resolve_user_id({"userId": drill_data.userId, "metadata": drill_data.metadata})
+                # ストアに保存できないIDはキューに積む前に弾く（書き込み時の失敗はクライアントに届かないため）
+                check_drill_key(drill_data.drillId, user_id)
+                coalesced, written = get_learning_writer().submit((user_id, drill_data.drillId), drill_data)
+        except WriterQueueFull as e:
+            raise HTTPException(status_code=503, detail=f"学習データ保存エラー: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"学習データ保存エラー: {str(e)}")
 
+        if wait:
+            try:
+                with stage("learning.wait_written"):
+                    # 同じドリルの他の保存も同じ Future を待つため、タイムアウトでキャンセルしない
+                    await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(written)), SAVE_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="学習データ保存エラー: 書き込みがタイムアウトしました")
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"学習データ保存エラー: {str(e)}")
+            return {
+                "success": True,
+                "drillId": drill_data.drillId,
+                "patternsExtracted": max(len(drill_data.sets) - 1, 0),
+                "queued": False,
+                "coalesced": coalesced,
+                "message": "ドリルを学習データとして保存しました"
+            }
+
+        return {
+            "success": True,
+            "drillId": drill_data.drillId,
+            "patternsExtracted": max(len(drill_data.sets) - 1, 0),
+            "queued": True,
+            "coalesced": coalesced,
+            "message": "ドリルを学習データの保存キューに追加しました"
+        }
+
+    @app.get("/learning/writer")
+    async def get_writer_stats() -> dict:
+        """バックグラウンド書き込みの状態（キュー長、書き込み時間など）"""
+        return get_learning_writer().stats()
+
+    def _writer_stat(key: str):
+        return lambda: get_learning_writer().stats()[key]
+
+    register_gauge("drill_learning_writer_queue_depth", "Drills waiting in the learning writer queue.", _writer_stat("queueDepth"))
+    register_gauge("drill_learning_writer_written_total", "Drills written by the learning writer.", _writer_stat("written"), "counter")
+    register_gauge("drill_learning_writer_failed_total", "Drills the learning writer failed to write.", _writer_stat("failed"), "counter")
+    register_gauge("drill_learning_writer_coalesced_total", "Saves replaced by a newer save of the same drill.", _writer_stat("coalesced"), "counter")
+    register_gauge("drill_learning_writer_last_flush_seconds", "Duration of the last writer batch.", lambda: get_learning_writer().stats()["lastFlushMs"] / 1000)
+
+    @app.on_event("shutdown")
+    def flush_learning_writer() -> None:
+        # 終了時にキューに残っている保存を書き切る
+        get_learning_writer().stop()
+
+    @app.on_event("startup")
+    def warm_formation_index() -> None:
+        # 初回の類似検索で全記述子を読み込まないよう、起動時にバックグラウンドで読み込んでおく
+        threading.Thread(target=get_formation_index().refresh, name="formation-index-warmup", daemon=True).start()
+
+    # 以下の参照系エンドポイントはSQLiteの集計や索引の読み込みを行うため、
+    # イベントループを止めないよう（async def ではなく）def で定義してスレッドプールで実行する
+
     @app.get("/learning/patterns")
-    async def get_patterns(user_id: Optional[str] = None) -> dict:
+    def get_patterns(user_id: Optional[str] = None) -> FastJSONResponse:
         """学習済みパターンを取得"""
         try:
-            patterns = load_learned_patterns(user_id)
-            return patterns
+            with stage("learning.statistics"):
+                patterns = load_learned_patterns(user_id)
+            return FastJSONResponse(patterns)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"パターン取得エラー: {str(e)}")
+
+    @app.post("/learning/similar")
+    def similar_formations(query: SimilarFormationQuery) -> FastJSONResponse:
+        """指定したフォーメーションに似たセットと、その次の遷移を取得"""
+        try:
+            return FastJSONResponse(find_similar_formations(query))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"類似検索エラー: {str(e)}")
+
+    @app.post("/learning/import")
+    async def import_drills(request: Request) -> dict:
+        """
+        NDJSON（1行1ドリル）で学習データを一括インポートする。
+
+        行ごとのエラーは errors に行番号つきで返し、他の行の取り込みは継続する。
+        """
+        try:
+            with stage("learning.import"):
+                return await import_ndjson(request.stream())
+        except ImportLineTooLarge as e:
+            raise HTTPException(status_code=413, detail=f"インポートエラー: {str(e)}")
+
+    @app.get("/learning/export")
+    async def export_drills(user_id: Optional[str] = None) -> StreamingResponse:
+        """学習データをNDJSON（1行1ドリル）でストリーミングエクスポートする"""
+        return StreamingResponse(export_ndjson(user_id), media_type="application/x-ndjson")
+
+    @app.get("/learning/drills")
+    def list_learning_drills(
+        user_id: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=500),
+        offset: int = Query(0, ge=0),
+    ) -> FastJSONResponse:
+        """学習データのドリル一覧を取得（新しい順、ページネーション対応）"""
+        with stage("learning.list_drills"):
+            drills = get_learning_store().list_drills(user_id, limit=limit + 1, offset=offset)
+        return FastJSONResponse({
+            "items": drills[:limit],
+            "limit": limit,
+            "offset": offset,
+            "hasMore": len(drills) > limit,
+        })
+
+    @app.get("/learning/drills/{drill_id}")
+    def get_learning_drill(drill_id: str, user_id: Optional[str] = None) -> FastJSONResponse:
+        """学習データのドリルを1件取得（user_id 省略時は所有ユーザーなしのドリル）"""
+        try:
+            with stage("learning.get_drill"):
+                drill = get_learning_store().get_drill(drill_id, user_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if drill is None:
+            raise HTTPException(status_code=404, detail="ドリルが見つかりません")
+        return FastJSONResponse(drill)
+
+    @app.get("/learning/sets")
+    def query_learning_sets(
+        user_id: Optional[str] = None,
+        section: Optional[str] = None,
+        formation_type: Optional[str] = None,
+        limit: int = Query(50, ge=1, le=500),
+        offset: int = Query(0, ge=0),
+    ) -> FastJSONResponse:
+        """ユーザー・セクション・フォーメーションタイプでセットを検索"""
+        with stage("learning.query_sets"):
+            sets = get_learning_store().query_sets(
+                user_id, section=section, formation_type=formation_type, limit=limit + 1, offset=offset
+            )
+        return FastJSONResponse({
+            "items": sets[:limit],
+            "limit": limit,
+            "offset": offset,
+            "hasMore": len(sets) > limit,
+        })
 else:
     @app.post("/learning/save-drill")
     async def save_drill(drill_data: dict) -> dict:
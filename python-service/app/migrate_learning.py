@@ -0,0 +1,103 @@
+"""
+既存のJSON学習データ（data/learning/*.json）をSQLiteストアへ移行する
+
+使い方:
+    python -m app.migrate_learning
+    python -m app.migrate_learning --source data/learning --db data/learning.db --batch-size 500
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import List, Tuple
+
+from pydantic import ValidationError
+
+from app.bulk import format_error
+from app.learning import DrillData, drill_to_array
+from app.similarity import compute_descriptors
+from app.storage import (
+    LEARNING_DATA_DIR,
+    LEARNING_DB_PATH,
+    DrillItem,
+    SQLiteLearningStore,
+    resolve_user_id,
+)
+
+
+def _ensure_descriptors(drill: dict) -> None:
+    """形状記述子がない（旧形式の）セットに記述子を付与する"""
+    sets = drill.get("sets", [])
+    if not sets or all(s.get("descriptor") for s in sets):
+        return
+    _, coords, valid = drill_to_array([s.get("positions") or {} for s in sets])
+    for set_data, descriptor in zip(sets, compute_descriptors(coords, valid)):
+        set_data["descriptor"] = descriptor.tolist()
+
+
+def _save_batch(store: SQLiteLearningStore, batch: List[Tuple[Path, DrillItem]], failed: List[str]) -> int:
+    """バッチを1トランザクションで保存。失敗した場合は1件ずつ保存し直し、失敗したファイルを記録する"""
+    try:
+        return store.save_drills([item for _, item in batch])
+    except Exception:
+        saved = 0
+        for file_path, item in batch:
+            try:
+                saved += store.save_drills([item])
+            except Exception as e:
+                failed.append(f"{file_path}: 保存に失敗しました: {e}")
+        return saved
+
+
+def migrate(source: Path, db_path: Path, batch_size: int = 500) -> dict:
+    """sourceディレクトリ以下のJSONをすべてSQLiteへ取り込む（同じ (user_id, drillId) は上書き）"""
+    store = SQLiteLearningStore(db_path)
+    migrated = 0
+    failed: List[str] = []
+    batch: List[Tuple[Path, DrillItem]] = []
+
+    files = sorted([*source.glob("*.json"), *source.glob("users/*/*.json")])
+    for file_path in files:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                drill = json.load(f)
+            # 壊れたファイル（setのidがないなど）は保存時ではなくここで弾く
+            DrillData.model_validate(drill)
+            _ensure_descriptors(drill)
+        except ValidationError as e:
+            failed.append(f"{file_path}: {format_error(e)}")
+            continue
+        except Exception as e:
+            failed.append(f"{file_path}: {e}")
+            continue
+
+        # users/<user_id>/ 以下のファイルはディレクトリ名を所有ユーザーとみなす
+        user_id = resolve_user_id(drill)
+        if user_id is None and file_path.parent.parent.name == "users":
+            user_id = file_path.parent.name
+        batch.append((file_path, (drill, user_id)))
+
+        if len(batch) >= batch_size:
+            migrated += _save_batch(store, batch, failed)
+            batch = []
+
+    if batch:
+        migrated += _save_batch(store, batch, failed)
+
+    return {"migrated": migrated, "failed": failed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="JSON学習データをSQLiteストアへ移行")
+    parser.add_argument("--source", type=Path, default=LEARNING_DATA_DIR, help="JSONファイルのディレクトリ")
+    parser.add_argument("--db", type=Path, default=LEARNING_DB_PATH, help="移行先のSQLiteファイル")
+    parser.add_argument("--batch-size", type=int, default=500, help="1トランザクションあたりのドリル数")
+    args = parser.parse_args()
+
+    result = migrate(args.source, args.db, args.batch_size)
+    print(f"移行完了: {result['migrated']}件")
+    for message in result["failed"]:
+        print(f"  スキップ: {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+計測とログ: 処理ステージごとの所要時間、Prometheus形式のメトリクス、構造化ログ
+
+- stage("music.decode") のように処理を囲むと、ヒストグラムに記録され、
+  リクエスト中であれば Server-Timing ヘッダーにも内訳として出力される
+- /metrics で Prometheus テキスト形式（text/plain; version=0.0.4）を返す
+"""
+import contextvars
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+class Histogram:
+    """ラベル付きヒストグラム（累積バケット）"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[LabelValues, List[float]] = {}  # ラベル → [各バケット..., +Inf, sum]
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            base = _format_labels(self.label_names, labels)
+            bounds = [*(f"{bound:g}" for bound in self.buckets), "+Inf"]
+            for bound, count in zip(bounds, series):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_wrap_labels(base, le)} {_format_value(count)}")
+            lines.append(f"{self.name}_sum{_wrap_labels(base)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_wrap_labels(base)} {_format_value(series[-2])}")
+        return lines
+
+
+class Counter:
+    """ラベル付きカウンター"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_wrap_labels(_format_labels(self.label_names, labels))} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """読み出し時に値を取得するゲージ（kind="counter" で累積値として出力）"""
+
+    def __init__(self, name: str, help_text: str, getter: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.getter = getter
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.getter())
+        except Exception:
+            value = math.nan
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_format_value(value)}"]
+
+
+def _format_value(value: float) -> str:
+    """サンプル値の出力（:g は有効数字6桁で丸めるため使わない）"""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _wrap_labels(*parts: str) -> str:
+    joined = ",".join(p for p in parts if p)
+    return f"{{{joined}}}" if joined else ""
+
+
+STAGE_DURATION = Histogram(
+    "drill_stage_duration_seconds", "Duration of individual processing stages.", ("stage",)
+)
+STAGE_ERRORS = Counter(
+    "drill_stage_errors_total", "Processing stages that raised an exception.", ("stage",)
+)
+REQUEST_DURATION = Histogram(
+    "drill_http_request_duration_seconds", "HTTP request duration.", ("method", "route", "status")
+)
+
+_metrics: List[object] = [STAGE_DURATION, STAGE_ERRORS, REQUEST_DURATION]
+_metrics_lock = threading.Lock()
+
+
+def register_gauge(name: str, help_text: str, getter: Callable[[], float], kind: str = "gauge") -> None:
+    with _metrics_lock:
+        if not any(getattr(m, "name", None) == name for m in _metrics):
+            _metrics.append(Gauge(name, help_text, getter, kind))
+
+
+def render_metrics() -> str:
+    """Prometheusテキスト形式で全メトリクスを出力"""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# リクエストごとのステージ計測結果（Server-Timing 用）。リクエスト外では None
+_request_timings: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """処理ステージの所要時間を計測する"""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_DURATION.observe(elapsed, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def begin_request() -> Tuple[List[Tuple[str, float]], contextvars.Token]:
+    timings: List[Tuple[str, float]] = []
+    return timings, _request_timings.set(timings)
+
+
+def end_request(token: contextvars.Token) -> None:
+    _request_timings.reset(token)
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    # 同じステージが複数回ある場合（ループ内など）は合計する
+    merged: Dict[str, float] = {}
+    for name, elapsed in timings:
+        merged[name] = merged.get(name, 0.0) + elapsed
+    entries = [f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in merged.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+_RESERVED_LOG_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def log_fields(**fields: object) -> Dict[str, object]:
+    """ログに付ける項目を extra= 用に包む
+
+    extra= に LogRecord の属性名（filename, module など）を直接渡すと KeyError になるため、
+    項目は1つの属性にまとめて渡し、JsonLogFormatter で展開する。
+    """
+    return {"fields": fields}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """1行1JSONのログ。extra= / log_fields() で渡した項目もフィールドとして出力する"""
+
+    _RESERVED = _RESERVED_LOG_ATTRS
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._RESERVED and key != "fields" and not key.startswith("_"):
+                payload[key] = value
+        fields = getattr(record, "fields", None)
+        if isinstance(fields, dict):
+            for key, value in fields.items():
+                payload.setdefault(key, value)
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """app.* ロガーを構造化ログ（JSON）で標準エラーに出力する"""
+    logger = logging.getLogger("app")
+    if any(isinstance(h.formatter, JsonLogFormatter) for h in logger.handlers):
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonLogFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
@@ -0,0 +1,53 @@
+"""
+JSONレスポンスの高速化
+
+FastAPI は response_model が指定されたエンドポイントの戻り値を、返却時にもう一度検証してから
+jsonable_encoder で dict に変換し、標準の json でエンコードする。サーバー側で組み立てた結果を
+FastJSONResponse で直接返すとこの再検証と変換が省略され、orjson が使える場合は
+NumPy配列もそのまま（tolist() なしで）エンコードできる。
+response_model はOpenAPIのスキーマ用に残しておく。
+"""
+import json
+from typing import Any
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+# orjsonの条件付きインポート（ない場合は標準のjsonで同じ形式を出力する）
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+if ORJSON_AVAILABLE:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any) -> Any:
+    """json / orjson が直接扱えない型の変換"""
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"JSONに変換できない型です: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """content をUTF-8のJSON（空白なし）に変換"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=_default
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """dumps でエンコードするJSONレスポンス"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,292 @@
+"""
+フォーメーション類似検索: 形状記述子と近傍探索インデックス
+
+記述子は平行移動・回転・拡大縮小に対して不変な固定長ベクトル:
+- 重心からの距離（RMS半径で正規化）のヒストグラム
+- メンバー間距離（同上）のヒストグラム
+- 共分散の固有値比（細長さ）
+L2正規化しているため、内積がそのままコサイン類似度になる。
+"""
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.storage import LearningStore, get_learning_store
+
+
+RADIAL_BINS = 12
+RADIAL_MAX = 3.0  # 正規化半径の上限（RMS半径の3倍）
+PAIRWISE_BINS = 16
+PAIRWISE_MAX = 4.0
+PAIRWISE_MAX_MEMBERS = 64  # メンバー間距離の計算に使う最大人数（間引き）
+INDEX_COMPACT_MIN_DEAD = 256  # 無効な行がこの数以上かつ有効な行より多くなったら詰め直す
+DESCRIPTOR_DIM = RADIAL_BINS + PAIRWISE_BINS + 1
+
+
+def compute_descriptors(coords: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    全セットの形状記述子を一括計算
+
+    Args:
+        coords: (セット数 × メンバー数 × 2) の座標配列（learning.drill_to_array）
+        valid: (セット数 × メンバー数) の在籍マスク
+
+    Returns:
+        (セット数 × DESCRIPTOR_DIM) の float32 配列。メンバーが3人未満のセットは0ベクトル
+    """
+    n_sets = coords.shape[0]
+    descriptors = np.zeros((n_sets, DESCRIPTOR_DIM), dtype=np.float32)
+    if n_sets == 0 or coords.shape[1] == 0:
+        return descriptors
+
+    counts = valid.sum(axis=1)
+    denom = np.maximum(counts, 1)[:, None]
+
+    # 平行移動: 重心を原点に
+    filled = np.where(valid[..., None], coords, 0.0)
+    centered = np.where(valid[..., None], filled - (filled.sum(axis=1) / denom)[:, None, :], 0.0)
+
+    # 拡大縮小: RMS半径で割る
+    radii = np.hypot(centered[..., 0], centered[..., 1])
+    rms = np.sqrt((radii ** 2).sum(axis=1) / denom[:, 0])
+    usable = (counts >= 3) & (rms > 1e-9)
+    scale = np.where(usable, rms, 1.0)
+    normalized = centered / scale[:, None, None]
+    radii = radii / scale[:, None]
+
+    # 重心からの距離のヒストグラム（回転不変）
+    radial_bins = np.minimum((radii / RADIAL_MAX * RADIAL_BINS).astype(np.int64), RADIAL_BINS - 1)
+    set_index = np.broadcast_to(np.arange(n_sets)[:, None], radial_bins.shape)
+    radial = np.zeros((n_sets, RADIAL_BINS))
+    np.add.at(radial, (set_index[valid], radial_bins[valid]), 1.0)
+    descriptors[:, :RADIAL_BINS] = radial / denom
+
+    # メンバー間距離のヒストグラム（大人数のセットは間引く）
+    pairwise = _pairwise_histograms(normalized, radii, valid & usable[:, None])
+    descriptors[:, RADIAL_BINS:RADIAL_BINS + PAIRWISE_BINS] = pairwise
+
+    # 共分散の固有値比（0: 直線的 〜 1: 等方的）
+    sxx = (normalized[..., 0] ** 2).sum(axis=1)
+    syy = (normalized[..., 1] ** 2).sum(axis=1)
+    sxy = (normalized[..., 0] * normalized[..., 1]).sum(axis=1)
+    half_trace = (sxx + syy) / 2
+    root = np.sqrt(np.maximum(half_trace ** 2 - (sxx * syy - sxy ** 2), 0.0))
+    largest = half_trace + root
+    descriptors[:, -1] = np.where(largest > 0, (half_trace - root) / np.maximum(largest, 1e-12), 0.0)
+
+    descriptors[~usable] = 0.0
+    norms = np.linalg.norm(descriptors, axis=1, keepdims=True)
+    return np.where(norms > 0, descriptors / np.maximum(norms, 1e-12), 0.0).astype(np.float32)
+
+
+def _subsample(normalized: np.ndarray, radii: np.ndarray, valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    各セットから最大 PAIRWISE_MAX_MEMBERS 人を形に基づいて選ぶ
+
+    重心からの距離（同じ場合は角度）で並べて等間隔に選ぶため、メンバーの並び順には依存しない。
+
+    Returns:
+        (セット数 × K × 2) の座標と (セット数 × K) のマスク（K = min(最大人数, PAIRWISE_MAX_MEMBERS)）
+    """
+    counts = valid.sum(axis=1)
+    k = int(min(counts.max(initial=0), PAIRWISE_MAX_MEMBERS))
+    # 在籍しているメンバーを先頭に詰める（全員を使うセットは順序が結果に影響しない）
+    order = np.argsort(~valid, axis=1, kind="stable")
+    large = counts > k
+    if large.any():
+        # 間引くセットだけ形で並べる。lexsort は最後のキーが第1キーで、在籍していないメンバーは末尾に回す
+        angles = np.arctan2(normalized[large, :, 1], normalized[large, :, 0])
+        order[large] = np.lexsort((angles, np.where(valid[large], radii[large], np.inf)), axis=1)
+
+    slots = np.arange(k)
+    ranks = np.where(
+        counts[:, None] > k,
+        slots * (counts[:, None] - 1) // max(k - 1, 1),  # np.linspace(0, count - 1, k) の切り捨てと同じ
+        slots,
+    )
+    mask = slots[None, :] < np.minimum(counts, k)[:, None]
+    members = np.take_along_axis(order, np.where(mask, ranks, 0), axis=1)
+    points = np.take_along_axis(normalized, members[..., None], axis=1)
+    return points, mask
+
+
+def _pairwise_histograms(
+    normalized: np.ndarray, radii: np.ndarray, valid: np.ndarray, chunk_size: int = 256
+) -> np.ndarray:
+    """メンバー間距離（正規化済み）のヒストグラムをセット単位でまとめて計算"""
+    n_sets = normalized.shape[0]
+    hist = np.zeros((n_sets, PAIRWISE_BINS))
+    for start in range(0, n_sets, chunk_size):
+        chunk = slice(start, start + chunk_size)
+        points, mask = _subsample(normalized[chunk], radii[chunk], valid[chunk])
+        n_chunk, k = mask.shape
+        if k < 2:
+            continue
+        first, second = np.triu_indices(k, k=1)
+        # 記述子は float32 で保存するため、ペアごとの距離も float32 で計算する（メモリ量が半分になる）
+        xs = np.ascontiguousarray(points[..., 0], dtype=np.float32)
+        ys = np.ascontiguousarray(points[..., 1], dtype=np.float32)
+        dx = xs[:, first] - xs[:, second]
+        dy = ys[:, first] - ys[:, second]
+        distances = np.sqrt(dx * dx + dy * dy)
+        bins = np.minimum((distances * (PAIRWISE_BINS / PAIRWISE_MAX)).astype(np.int32), PAIRWISE_BINS - 1)
+        # 選ばれたメンバーは先頭に詰まっているため、後ろ側のメンバーが選ばれていればペアは有効。
+        # 無効なペアは余分なビン（PAIRWISE_BINS）に入れて捨てる
+        selected = mask.sum(axis=1)
+        bins = np.where(second[None, :] < selected[:, None], bins, PAIRWISE_BINS)
+        bins += (np.arange(n_chunk, dtype=np.int32) * (PAIRWISE_BINS + 1))[:, None]
+        counts = np.bincount(bins.ravel(), minlength=n_chunk * (PAIRWISE_BINS + 1))
+        counts = counts.reshape(n_chunk, PAIRWISE_BINS + 1)[:, :PAIRWISE_BINS]
+        hist[chunk] = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    return hist
+
+
+class FormationIndex:
+    """
+    形状記述子のインメモリ近傍探索インデックス
+
+    ストアに保存された記述子を初回検索時に読み込み、以降は検索のたびに
+    追加・更新分（ストアの連番より後）だけを取り込む。
+    上書き保存されたドリルは元の行を再利用し、セット数が減って無効になった行は
+    一定数たまった時点で詰め直すため、メモリと検索コストは保存回数ではなく現在のセット数に比例する。
+    """
+
+    def __init__(self, store: LearningStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((0, DESCRIPTOR_DIM), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._users = np.zeros(0, dtype=np.int64)
+        self._keys: List[Tuple[Optional[str], str, int]] = []  # 行 → (user_id, drillId, セット番号)
+        self._drill_rows: Dict[Tuple[Optional[str], str], np.ndarray] = {}  # (user_id, drillId) → 行
+        self._drill_owners: Dict[str, Set[Optional[str]]] = {}  # drillId → そのIDで保存しているユーザー
+        self._user_codes: Dict[Optional[str], int] = {}
+        self._size = 0  # 使用中の行数（無効な行を含む）
+        self._dead = 0  # 無効な行の数
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return self._size - self._dead
+
+    def refresh(self) -> None:
+        """ストアから前回以降に保存された記述子を取り込む"""
+        with self._lock:
+            for seq, drill_id, user_id, matrix in self.store.iter_descriptors(after=self._seq):
+                self._add_drill(drill_id, user_id, matrix)
+                self._seq = max(self._seq, seq)
+            if self._dead >= INDEX_COMPACT_MIN_DEAD and self._dead > self._size - self._dead:
+                self._compact()
+
+    def _add_drill(self, drill_id: str, user_id: Optional[str], matrix: np.ndarray) -> None:
+        key = (user_id, drill_id)
+        old_rows = self._drill_rows.pop(key, np.zeros(0, dtype=np.int64))
+        rows = np.flatnonzero(np.linalg.norm(matrix, axis=1) > 0)
+
+        # 上書き保存: 古い行を再利用し、余った行は無効化、足りない分は末尾に追加する
+        reused = old_rows[:len(rows)]
+        self._alive[old_rows[len(rows):]] = False
+        self._dead += max(len(old_rows) - len(rows), 0)
+        if len(rows) == 0:
+            owners = self._drill_owners.get(drill_id, set())
+            owners.discard(user_id)
+            if not owners:
+                self._drill_owners.pop(drill_id, None)
+            return
+
+        extra = len(rows) - len(reused)
+        self._reserve(self._size + extra)
+        new_rows = np.concatenate([reused, np.arange(self._size, self._size + extra)])
+        keys = [(user_id, drill_id, set_index) for set_index in rows.tolist()]
+        for row, row_key in zip(reused.tolist(), keys):
+            self._keys[row] = row_key
+        self._keys.extend(keys[len(reused):])
+        self._size += extra
+
+        user_code = self._user_codes.setdefault(user_id, len(self._user_codes))
+        self._vectors[new_rows] = matrix[rows]
+        self._alive[new_rows] = True
+        self._users[new_rows] = user_code
+        self._drill_rows[key] = new_rows
+        self._drill_owners.setdefault(drill_id, set()).add(user_id)
+
+    def _compact(self) -> None:
+        """無効な行を取り除いて詰め直し、配列も現在の行数に合わせて縮める"""
+        keep = np.flatnonzero(self._alive[:self._size])
+        remap = np.full(self._size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        capacity = max(len(keep) * 2, 1024)
+        vectors = np.zeros((capacity, DESCRIPTOR_DIM), dtype=np.float32)
+        vectors[:len(keep)] = self._vectors[keep]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(keep)] = True
+        users = np.zeros(capacity, dtype=np.int64)
+        users[:len(keep)] = self._users[keep]
+        self._vectors, self._alive, self._users = vectors, alive, users
+        self._keys = [self._keys[row] for row in keep.tolist()]
+        self._drill_rows = {key: remap[rows] for key, rows in self._drill_rows.items()}
+        self._size = len(keep)
+        self._dead = 0
+
+    def _reserve(self, capacity: int) -> None:
+        if capacity <= len(self._vectors):
+            return
+        new_capacity = max(capacity, len(self._vectors) * 2, 1024)
+        vectors = np.zeros((new_capacity, DESCRIPTOR_DIM), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        users = np.zeros(new_capacity, dtype=np.int64)
+        users[:self._size] = self._users[:self._size]
+        self._vectors, self._alive, self._users = vectors, alive, users
+
+    def search(
+        self,
+        descriptor: np.ndarray,
+        k: int = 5,
+        user_id: Optional[str] = None,
+        exclude_drill_id: Optional[str] = None,
+    ) -> List[Tuple[Optional[str], str, int, float]]:
+        """コサイン類似度の高い順に (user_id, drillId, セット番号, スコア) を最大k件返す
+
+        exclude_drill_id は検索対象（user_id 指定時はそのユーザー）の中でそのIDのドリルを除外する。
+        """
+        self.refresh()
+        with self._lock:
+            n = self._size
+            if n == 0 or k <= 0:
+                return []
+            scores = self._vectors[:n] @ descriptor.astype(np.float32)
+            mask = self._alive[:n].copy()
+            if user_id is not None:
+                code = self._user_codes.get(user_id)
+                if code is None:
+                    return []
+                mask &= self._users[:n] == code
+            if exclude_drill_id is not None:
+                owners = self._drill_owners.get(exclude_drill_id, set())
+                for owner in owners if user_id is None else owners & {user_id}:
+                    rows = self._drill_rows.get((owner, exclude_drill_id))
+                    if rows is not None:
+                        mask[rows] = False
+            scores = np.where(mask, scores, -np.inf)
+
+            k = min(k, int(mask.sum()))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(*self._keys[row], float(scores[row])) for row in top]
+
+
+_index: Optional[FormationIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_formation_index() -> FormationIndex:
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = FormationIndex(get_learning_store())
+    return _index
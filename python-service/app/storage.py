@@ -0,0 +1,793 @@
+"""
+学習データのストレージ層
+
+- SQLiteLearningStore: 埋め込みSQLite（インデックス付き、デフォルト）
+- FileLearningStore: 従来のJSONファイル形式（互換性のため）
+
+どちらもユーザー単位のスコープ、ページネーション、アトミックな書き込みに対応する。
+ドリルは (user_id, drillId) で識別する。別のユーザーが同じ drillId で保存しても別のドリルとして扱い、
+他のユーザーのドリルを上書きすることはない（user_id=None は所有ユーザーなしのドリル）。
+"""
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+# データ保存先
+DATA_DIR = Path(__file__).parent.parent / "data"
+LEARNING_DATA_DIR = DATA_DIR / "learning"
+LEARNING_DB_PATH = Path(os.environ.get("LEARNING_DB_PATH", DATA_DIR / "learning.db"))
+LEARNING_STORE_BACKEND = os.environ.get("LEARNING_STORE", "sqlite")  # "sqlite" or "file"
+
+# ファイル名・ディレクトリ名に使える ID（パストラバーサル防止）
+_SAFE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.@-]{1,200}$")
+
+DrillItem = Tuple[Dict[str, Any], Optional[str]]  # (ドリルデータ, user_id)
+DescriptorRow = Tuple[int, str, Optional[str], np.ndarray]  # (連番, drillId, user_id, 記述子行列)
+SetKey = Tuple[Optional[str], str, int]  # (user_id, drillId, セット番号)
+
+
+def resolve_user_id(drill: Dict[str, Any]) -> Optional[str]:
+    """ドリルデータから所有ユーザーIDを取得（userId → metadata.createdBy の順）"""
+    user_id = drill.get("userId")
+    if not user_id:
+        user_id = (drill.get("metadata") or {}).get("createdBy")
+    return str(user_id) if user_id else None
+
+
+def _check_id(value: str, label: str) -> str:
+    if not _SAFE_ID_PATTERN.match(value) or value in (".", ".."):
+        raise ValueError(f"不正な{label}です: {value!r}")
+    return value
+
+
+def check_drill_key(drill_id: str, user_id: Optional[str] = None) -> None:
+    """drillId / user_id がどのストアでも保存できる形式か検証（不正な場合は ValueError）"""
+    _check_id(drill_id, "drillId")
+    if user_id:
+        _check_id(user_id, "user_id")
+
+
+def _empty_statistics() -> Dict[str, Any]:
+    return {
+        "sectionPreferences": {},
+        "statistics": {
+            "totalDrills": 0,
+            "totalSets": 0,
+            "avgSetsPerDrill": 0
+        }
+    }
+
+
+def _aggregate_drills(drills: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """ドリルデータを走査して統計を計算（ファイルストア用）"""
+    total_drills = 0
+    total_sets = 0
+    formation_counts: Dict[str, int] = {}
+    transition_counts: Dict[str, int] = {}
+    section_stats: Dict[str, Dict[str, Any]] = {}
+
+    for drill in drills:
+        total_drills += 1
+        total_sets += len(drill.get("sets", []))
+
+        for set_data in drill.get("sets", []):
+            formation = set_data.get("formationType", "custom")
+            formation_counts[formation] = formation_counts.get(formation, 0) + 1
+
+            section = set_data.get("section")
+            if section:
+                if section not in section_stats:
+                    section_stats[section] = {
+                        "count": 0,
+                        "formations": {},
+                        "avgMovementDistance": []
+                    }
+                section_stats[section]["count"] += 1
+                section_stats[section]["formations"][formation] = \
+                    section_stats[section]["formations"].get(formation, 0) + 1
+
+        for transition in drill.get("transitions") or []:
+            movement_type = transition.get("movementType", "unknown")
+            transition_counts[movement_type] = transition_counts.get(movement_type, 0) + 1
+
+            section = transition.get("section")
+            if section and section in section_stats:
+                avg_dist = transition.get("avgDistance", 0)
+                if avg_dist > 0:
+                    section_stats[section]["avgMovementDistance"].append(avg_dist)
+
+    if total_drills == 0:
+        return _empty_statistics()
+
+    # セクション別の平均移動距離を計算
+    for section in section_stats:
+        distances = section_stats[section]["avgMovementDistance"]
+        if distances:
+            section_stats[section]["avgMovementDistance"] = float(np.mean(distances))
+        else:
+            section_stats[section]["avgMovementDistance"] = 0.0
+
+    return _build_statistics(total_drills, total_sets, formation_counts, transition_counts, section_stats)
+
+
+def _build_statistics(
+    total_drills: int,
+    total_sets: int,
+    formation_counts: Dict[str, int],
+    transition_counts: Dict[str, int],
+    section_stats: Dict[str, Dict[str, Any]],
+) -> Dict[str, Any]:
+    return {
+        "sectionPreferences": section_stats,
+        "statistics": {
+            "totalDrills": total_drills,
+            "totalSets": total_sets,
+            "avgSetsPerDrill": total_sets / total_drills if total_drills else 0,
+            "mostUsedFormation": max(formation_counts.items(), key=lambda x: x[1])[0] if formation_counts else None,
+            "mostUsedTransition": max(transition_counts.items(), key=lambda x: x[1])[0] if transition_counts else None
+        }
+    }
+
+
+def _drill_summary(drill: Dict[str, Any], user_id: Optional[str], updated_at: float) -> Dict[str, Any]:
+    return {
+        "drillId": drill["drillId"],
+        "userId": user_id,
+        "title": drill.get("title"),
+        "setCount": len(drill.get("sets", [])),
+        "transitionCount": len(drill.get("transitions") or []),
+        "updatedAt": updated_at,
+    }
+
+
+def descriptor_matrix(drill: Dict[str, Any]) -> Optional[np.ndarray]:
+    """各セットの descriptor を (セット数 × 次元) の行列にまとめる（未計算なら None）"""
+    vectors = [s.get("descriptor") for s in drill.get("sets", [])]
+    dims = {len(v) for v in vectors if v}
+    if len(dims) != 1:
+        return None
+    dim = dims.pop()
+    return np.array([v if v else [0.0] * dim for v in vectors], dtype=np.float32)
+
+
+def _set_context(drill: Dict[str, Any], set_index: int) -> Optional[Dict[str, Any]]:
+    sets = drill.get("sets", [])
+    if not 0 <= set_index < len(sets):
+        return None
+    set_data = sets[set_index]
+    transitions = drill.get("transitions") or []
+    next_move = None
+    if set_index < len(transitions):
+        transition = transitions[set_index]
+        next_set = sets[set_index + 1]
+        next_move = {
+            "toSetId": transition.get("toSetId"),
+            "toFormationType": next_set.get("formationType"),
+            "duration": next_set.get("startCount", 0) - set_data.get("startCount", 0),
+            "movementType": transition.get("movementType"),
+            "avgDistance": transition.get("avgDistance"),
+        }
+    return {
+        "setId": set_data.get("id"),
+        "section": set_data.get("section"),
+        "formationType": set_data.get("formationType"),
+        "startCount": set_data.get("startCount"),
+        "nextTransition": next_move,
+    }
+
+
+class LearningStore(ABC):
+    """学習データストレージのインターフェース"""
+
+    @abstractmethod
+    def save_drills(self, items: Iterable[DrillItem]) -> int:
+        """複数のドリルを保存（同じ (user_id, drillId) のドリルは上書き）。保存件数を返す"""
+
+    def save_drill(self, drill: Dict[str, Any], user_id: Optional[str] = None) -> None:
+        self.save_drills([(drill, user_id)])
+
+    @abstractmethod
+    def generation(self) -> Optional[int]:
+        """書き込みごと（save_drills 1回につき1）に増える世代番号。統計キャッシュの無効化に使う
+
+        他のプロセス（別のワーカーや移行ツール）の書き込みを追跡できないストアは None を返す（キャッシュしない）。
+        """
+
+    @abstractmethod
+    def get_drill(self, drill_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """(user_id, drillId) でドリルデータを取得（user_id=None は所有ユーザーなしのドリル）"""
+
+    @abstractmethod
+    def iter_drills(self, user_id: Optional[str] = None, batch_size: int = 200) -> Iterable[Dict[str, Any]]:
+        """ドリルデータをすべて返す（batch_size件ずつ読み込み、メモリ使用量を抑える）"""
+
+    @abstractmethod
+    def list_drills(
+        self, user_id: Optional[str] = None, limit: int = 50, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        """ドリルの概要一覧を更新日時の新しい順に取得"""
+
+    @abstractmethod
+    def query_sets(
+        self,
+        user_id: Optional[str] = None,
+        section: Optional[str] = None,
+        formation_type: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """ユーザー・セクション・フォーメーションタイプでセットを検索"""
+
+    @abstractmethod
+    def compute_statistics(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """セクション別傾向と全体統計を計算"""
+
+    @abstractmethod
+    def iter_descriptors(self, after: int = 0) -> Iterable[DescriptorRow]:
+        """連番がafterより大きいドリルの形状記述子を (連番, drillId, user_id, 行列) で返す"""
+
+    @abstractmethod
+    def get_set_context(self, keys: List[SetKey]) -> Dict[SetKey, Dict[str, Any]]:
+        """(user_id, drillId, セット番号) ごとに、セットの概要と次のセットへの遷移を返す"""
+
+
+class FileLearningStore(LearningStore):
+    """JSONファイルベースのストア（従来形式との互換用）
+
+    ユーザーIDがあるドリルは ``users/<user_id>/<drillId>.json``、ないドリルは ``<drillId>.json`` に保存する。
+    """
+
+    def __init__(self, root: Path = LEARNING_DATA_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, drill_id: str, user_id: Optional[str]) -> Path:
+        _check_id(drill_id, "drillId")
+        if user_id:
+            return self.root / "users" / _check_id(user_id, "user_id") / f"{drill_id}.json"
+        return self.root / f"{drill_id}.json"
+
+    def _iter_files(self, user_id: Optional[str] = None) -> Iterable[Tuple[Path, Optional[str]]]:
+        if user_id:
+            user_dir = self.root / "users" / _check_id(user_id, "user_id")
+            for file_path in user_dir.glob("*.json"):
+                yield file_path, user_id
+            return
+        for file_path in self.root.glob("*.json"):
+            yield file_path, None
+        for file_path in self.root.glob("users/*/*.json"):
+            yield file_path, file_path.parent.name
+
+    @staticmethod
+    def _read(file_path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def save_drills(self, items: Iterable[DrillItem]) -> int:
+        saved = 0
+        for drill, user_id in items:
+            file_path = self._path(drill["drillId"], user_id)
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # 一時ファイルに書いてからリネーム（書き込み途中のファイルを読ませない）
+            fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(drill, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, file_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            saved += 1
+        return saved
+
+    def generation(self) -> Optional[int]:
+        # ファイルは他のプロセスからも書き込まれるが、それを確実に検知できる共有の世代番号がないため常に読み直す
+        return None
+
+    def get_drill(self, drill_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        file_path = self._path(drill_id, user_id)
+        return self._read(file_path) if file_path.exists() else None
+
+    def iter_drills(self, user_id: Optional[str] = None, batch_size: int = 200) -> Iterable[Dict[str, Any]]:
+        for file_path, _ in self._iter_files(user_id):
+            drill = self._read(file_path)
+            if drill is not None:
+                yield drill
+
+    def list_drills(
+        self, user_id: Optional[str] = None, limit: int = 50, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        files = sorted(
+            self._iter_files(user_id),
+            key=lambda item: (-item[0].stat().st_mtime, item[0].stem),
+        )
+        summaries = []
+        for file_path, owner in files[offset:offset + limit]:
+            drill = self._read(file_path)
+            if drill is not None:
+                summaries.append(_drill_summary(drill, owner, file_path.stat().st_mtime))
+        return summaries
+
+    def query_sets(
+        self,
+        user_id: Optional[str] = None,
+        section: Optional[str] = None,
+        formation_type: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        results = []
+        for file_path, owner in self._iter_files(user_id):
+            drill = self._read(file_path)
+            if drill is None:
+                continue
+            for index, set_data in enumerate(drill.get("sets", [])):
+                if section and set_data.get("section") != section:
+                    continue
+                if formation_type and set_data.get("formationType") != formation_type:
+                    continue
+                results.append({
+                    "drillId": drill["drillId"],
+                    "userId": owner,
+                    "setIndex": index,
+                    **set_data,
+                })
+        return results[offset:offset + limit]
+
+    def compute_statistics(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        drills = (self._read(file_path) for file_path, _ in self._iter_files(user_id))
+        return _aggregate_drills(d for d in drills if d is not None)
+
+    def iter_descriptors(self, after: int = 0) -> Iterable[DescriptorRow]:
+        # ファイルストアでは更新時刻（ナノ秒）を連番として使う
+        for file_path, owner in self._iter_files():
+            try:
+                seq = file_path.stat().st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if seq <= after:
+                continue
+            drill = self._read(file_path)
+            if drill is None:
+                continue
+            matrix = descriptor_matrix(drill)
+            if matrix is not None:
+                yield seq, drill["drillId"], owner, matrix
+
+    def get_set_context(self, keys: List[SetKey]) -> Dict[SetKey, Dict[str, Any]]:
+        drills: Dict[Tuple[Optional[str], str], Optional[Dict[str, Any]]] = {}
+        results = {}
+        for user_id, drill_id, set_index in keys:
+            if (user_id, drill_id) not in drills:
+                drills[(user_id, drill_id)] = self.get_drill(drill_id, user_id)
+            drill = drills[(user_id, drill_id)]
+            context = _set_context(drill, set_index) if drill else None
+            if context is not None:
+                results[(user_id, drill_id, set_index)] = context
+        return results
+
+
+# 所有ユーザーなしのドリルは user_id = '' として保存する（NULLは主キーの一意性に使えないため）
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS drills (
+    user_id TEXT NOT NULL,
+    drill_id TEXT NOT NULL,
+    title TEXT,
+    set_count INTEGER NOT NULL,
+    transition_count INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (user_id, drill_id)
+);
+CREATE INDEX IF NOT EXISTS idx_drills_user_updated ON drills (user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_drills_updated ON drills (updated_at DESC);
+
+CREATE TABLE IF NOT EXISTS sets (
+    user_id TEXT NOT NULL,
+    drill_id TEXT NOT NULL,
+    set_index INTEGER NOT NULL,
+    set_id TEXT NOT NULL,
+    section TEXT,
+    formation_type TEXT,
+    start_count REAL,
+    PRIMARY KEY (user_id, drill_id, set_index)
+);
+CREATE INDEX IF NOT EXISTS idx_sets_user_section ON sets (user_id, section);
+CREATE INDEX IF NOT EXISTS idx_sets_user_formation ON sets (user_id, formation_type);
+CREATE INDEX IF NOT EXISTS idx_sets_section ON sets (section);
+CREATE INDEX IF NOT EXISTS idx_sets_formation ON sets (formation_type);
+
+CREATE TABLE IF NOT EXISTS transitions (
+    user_id TEXT NOT NULL,
+    drill_id TEXT NOT NULL,
+    transition_index INTEGER NOT NULL,
+    from_set_id TEXT,
+    to_set_id TEXT,
+    section TEXT,
+    movement_type TEXT,
+    avg_distance REAL,
+    PRIMARY KEY (user_id, drill_id, transition_index)
+);
+CREATE INDEX IF NOT EXISTS idx_transitions_user_movement ON transitions (user_id, movement_type);
+CREATE INDEX IF NOT EXISTS idx_transitions_movement ON transitions (movement_type);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+
+CREATE TABLE IF NOT EXISTS set_descriptors (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    drill_id TEXT NOT NULL,
+    set_count INTEGER NOT NULL,
+    dim INTEGER NOT NULL,
+    vectors BLOB NOT NULL,
+    UNIQUE (user_id, drill_id)
+);
+"""
+
+def _user_key(user_id: Optional[str]) -> str:
+    return user_id or ""
+
+
+def _user_value(user_key: str) -> Optional[str]:
+    return user_key or None
+
+
+class SQLiteLearningStore(LearningStore):
+    """埋め込みSQLiteストア（デフォルト）
+
+    ドリル本体はJSONとして ``drills`` に、検索用の列は ``sets`` / ``transitions`` に
+    インデックス付きで正規化して保存する。1ドリルの保存は1トランザクションで行う。
+    """
+
+    def __init__(self, db_path: Path = LEARNING_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _write_drill(conn: sqlite3.Connection, drill: Dict[str, Any], user_key: str, updated_at: float) -> None:
+        drill_id = drill["drillId"]
+        sets = drill.get("sets", [])
+        transitions = drill.get("transitions") or []
+        key = (user_key, drill_id)
+        conn.execute("DELETE FROM sets WHERE user_id = ? AND drill_id = ?", key)
+        conn.execute("DELETE FROM transitions WHERE user_id = ? AND drill_id = ?", key)
+        conn.execute(
+            "INSERT OR REPLACE INTO drills "
+            "(user_id, drill_id, title, set_count, transition_count, updated_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                user_key,
+                drill_id,
+                drill.get("title"),
+                len(sets),
+                len(transitions),
+                updated_at,
+                json.dumps(drill, ensure_ascii=False, separators=(",", ":")),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO sets "
+            "(user_id, drill_id, set_index, set_id, section, formation_type, start_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    user_key,
+                    drill_id,
+                    index,
+                    s["id"],
+                    s.get("section"),
+                    s.get("formationType", "custom"),
+                    s.get("startCount"),
+                )
+                for index, s in enumerate(sets)
+            ],
+        )
+        conn.executemany(
+            "INSERT INTO transitions "
+            "(user_id, drill_id, transition_index, from_set_id, to_set_id, section, "
+            "movement_type, avg_distance) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    user_key,
+                    drill_id,
+                    index,
+                    t.get("fromSetId"),
+                    t.get("toSetId"),
+                    t.get("section"),
+                    t.get("movementType", "unknown"),
+                    t.get("avgDistance"),
+                )
+                for index, t in enumerate(transitions)
+            ],
+        )
+        # 類似検索用の形状記述子（AUTOINCREMENTの連番で差分読み込みできるようにする）
+        conn.execute("DELETE FROM set_descriptors WHERE user_id = ? AND drill_id = ?", key)
+        matrix = descriptor_matrix(drill)
+        if matrix is not None:
+            conn.execute(
+                "INSERT INTO set_descriptors (user_id, drill_id, set_count, dim, vectors) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_key, drill_id, matrix.shape[0], matrix.shape[1], matrix.tobytes()),
+            )
+
+    def save_drills(self, items: Iterable[DrillItem]) -> int:
+        conn = self._conn()
+        now = time.time()
+        saved = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for drill, user_id in items:
+                # ファイルストアと同じ形式のIDだけを受け付ける（ストア間で移行・エクスポートできるように）
+                check_drill_key(drill["drillId"], user_id)
+                self._write_drill(conn, drill, _user_key(user_id), now)
+                saved += 1
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return saved
+
+    def generation(self) -> int:
+        # 他のワーカープロセスの書き込みも反映される
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row["value"] if row else 0
+
+    def get_drill(self, drill_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM drills WHERE user_id = ? AND drill_id = ?", (_user_key(user_id), drill_id)
+        ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def iter_drills(self, user_id: Optional[str] = None, batch_size: int = 200) -> Iterable[Dict[str, Any]]:
+        # (user_id, drill_id) によるキーセットページネーション（OFFSETより大規模データで速い）。
+        # StreamingResponse は next() を空いているスレッドから呼ぶため、接続はバッチごとに取得する
+        last: Optional[Tuple[str, str]] = None
+        while True:
+            conditions = []
+            params: List[Any] = []
+            if user_id:
+                conditions.append("user_id = ?")
+                params.append(user_id)
+            if last is not None:
+                conditions.append("(user_id, drill_id) > (?, ?)")
+                params.extend(last)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            rows = self._conn().execute(
+                f"SELECT user_id, drill_id, data FROM drills {where} ORDER BY user_id, drill_id LIMIT ?",
+                (*params, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row["data"])
+            last = (rows[-1]["user_id"], rows[-1]["drill_id"])
+
+    def list_drills(
+        self, user_id: Optional[str] = None, limit: int = 50, offset: int = 0
+    ) -> List[Dict[str, Any]]:
+        where, params = self._user_filter(user_id)
+        rows = self._conn().execute(
+            "SELECT drill_id, user_id, title, set_count, transition_count, updated_at "
+            f"FROM drills {where} ORDER BY updated_at DESC, user_id, drill_id LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+        return [
+            {
+                "drillId": row["drill_id"],
+                "userId": _user_value(row["user_id"]),
+                "title": row["title"],
+                "setCount": row["set_count"],
+                "transitionCount": row["transition_count"],
+                "updatedAt": row["updated_at"],
+            }
+            for row in rows
+        ]
+
+    def query_sets(
+        self,
+        user_id: Optional[str] = None,
+        section: Optional[str] = None,
+        formation_type: Optional[str] = None,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> List[Dict[str, Any]]:
+        conditions = []
+        params: List[Any] = []
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if section:
+            conditions.append("section = ?")
+            params.append(section)
+        if formation_type:
+            conditions.append("formation_type = ?")
+            params.append(formation_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._conn()
+        rows = conn.execute(
+            f"SELECT user_id, drill_id, set_index FROM sets {where} "
+            "ORDER BY user_id, drill_id, set_index LIMIT ? OFFSET ?",
+            (*params, limit, offset),
+        ).fetchall()
+
+        # 該当ドリルの本体をまとめて読み込み、セットの詳細（positions など）を返す
+        drills = self._load_drills(conn, sorted({(row["user_id"], row["drill_id"]) for row in rows}))
+        results = []
+        for row in rows:
+            drill = drills.get((row["user_id"], row["drill_id"]))
+            if drill is None:
+                continue
+            results.append({
+                "drillId": row["drill_id"],
+                "userId": _user_value(row["user_id"]),
+                "setIndex": row["set_index"],
+                **drill["sets"][row["set_index"]],
+            })
+        return results
+
+    @staticmethod
+    def _load_drills(
+        conn: sqlite3.Connection, keys: List[Tuple[str, str]], chunk_size: int = 400
+    ) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        drills: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            values = ",".join(["(?, ?)"] * len(chunk))
+            for row in conn.execute(
+                f"SELECT user_id, drill_id, data FROM drills WHERE (user_id, drill_id) IN (VALUES {values})",
+                [value for key in chunk for value in key],
+            ):
+                drills[(row["user_id"], row["drill_id"])] = json.loads(row["data"])
+        return drills
+
+    def compute_statistics(self, user_id: Optional[str] = None) -> Dict[str, Any]:
+        conn = self._conn()
+        where, params = self._user_filter(user_id)
+
+        total_drills, total_sets = conn.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(set_count), 0) FROM drills {where}", params
+        ).fetchone()
+        if total_drills == 0:
+            return _empty_statistics()
+
+        formation_counts = {
+            row[0]: row[1]
+            for row in conn.execute(
+                f"SELECT formation_type, COUNT(*) FROM sets {where} GROUP BY formation_type", params
+            )
+        }
+        transition_counts = {
+            row[0]: row[1]
+            for row in conn.execute(
+                f"SELECT movement_type, COUNT(*) FROM transitions {where} GROUP BY movement_type", params
+            )
+        }
+
+        section_where = f"{where} AND section IS NOT NULL" if where else "WHERE section IS NOT NULL"
+        section_stats: Dict[str, Dict[str, Any]] = {}
+        for section, formation, count in conn.execute(
+            f"SELECT section, formation_type, COUNT(*) FROM sets {section_where} "
+            "GROUP BY section, formation_type",
+            params,
+        ):
+            if section not in section_stats:
+                section_stats[section] = {
+                    "count": 0,
+                    "formations": {},
+                    "avgMovementDistance": 0.0
+                }
+            section_stats[section]["count"] += count
+            section_stats[section]["formations"][formation] = count
+
+        for section, avg_distance in conn.execute(
+            f"SELECT section, AVG(avg_distance) FROM transitions {section_where} "
+            "AND avg_distance > 0 GROUP BY section",
+            params,
+        ):
+            if section in section_stats:
+                section_stats[section]["avgMovementDistance"] = float(avg_distance)
+
+        return _build_statistics(total_drills, total_sets, formation_counts, transition_counts, section_stats)
+
+    def iter_descriptors(self, after: int = 0) -> Iterable[DescriptorRow]:
+        rows = self._conn().execute(
+            "SELECT seq, drill_id, user_id, set_count, dim, vectors FROM set_descriptors "
+            "WHERE seq > ? ORDER BY seq",
+            (after,),
+        )
+        for row in rows:
+            matrix = np.frombuffer(row["vectors"], dtype=np.float32).reshape(row["set_count"], row["dim"])
+            yield row["seq"], row["drill_id"], _user_value(row["user_id"]), matrix
+
+    def get_set_context(self, keys: List[SetKey]) -> Dict[SetKey, Dict[str, Any]]:
+        conn = self._conn()
+        results = {}
+        for user_id, drill_id, set_index in keys:
+            row = conn.execute(
+                "SELECT s.set_id, s.section, s.formation_type, s.start_count, "
+                "t.to_set_id, t.movement_type, t.avg_distance, "
+                "n.formation_type AS next_formation, n.start_count AS next_start "
+                "FROM sets s "
+                "LEFT JOIN transitions t ON t.user_id = s.user_id AND t.drill_id = s.drill_id "
+                "AND t.transition_index = s.set_index "
+                "LEFT JOIN sets n ON n.user_id = s.user_id AND n.drill_id = s.drill_id "
+                "AND n.set_index = s.set_index + 1 "
+                "WHERE s.user_id = ? AND s.drill_id = ? AND s.set_index = ?",
+                (_user_key(user_id), drill_id, set_index),
+            ).fetchone()
+            if row is None:
+                continue
+            next_move = None
+            if row["to_set_id"] is not None:
+                next_move = {
+                    "toSetId": row["to_set_id"],
+                    "toFormationType": row["next_formation"],
+                    "duration": (row["next_start"] or 0) - (row["start_count"] or 0),
+                    "movementType": row["movement_type"],
+                    "avgDistance": row["avg_distance"],
+                }
+            results[(user_id, drill_id, set_index)] = {
+                "setId": row["set_id"],
+                "section": row["section"],
+                "formationType": row["formation_type"],
+                "startCount": row["start_count"],
+                "nextTransition": next_move,
+            }
+        return results
+
+    @staticmethod
+    def _user_filter(user_id: Optional[str]) -> Tuple[str, Tuple[Any, ...]]:
+        if user_id:
+            return "WHERE user_id = ?", (user_id,)
+        return "", ()
+
+
+_store: Optional[LearningStore] = None
+_store_lock = threading.Lock()
+
+
+def get_learning_store() -> LearningStore:
+    """設定（環境変数 LEARNING_STORE）に応じたストアを返す"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if LEARNING_STORE_BACKEND == "file":
+                    _store = FileLearningStore()
+                elif LEARNING_STORE_BACKEND == "sqlite":
+                    _store = SQLiteLearningStore()
+                else:
+                    raise ValueError(f"不明なストア種別です: {LEARNING_STORE_BACKEND}")
+    return _store
@@ -0,0 +1,231 @@
+"""
+学習データのバックグラウンド書き込み
+
+/learning/save-drill はドリルをキューに積んで即座に返し、特徴量計算と
+ストアへの書き込みは専用スレッドでまとめて行う。
+- キューは (user_id, drillId) 単位で保持し、書き込み前に同じドリルが再送された場合は最新の内容で置き換える
+- キューの上限を超えた場合は WriterQueueFull を送出する（APIでは503）
+- 書き込みはストアのトランザクション / 一時ファイル+リネームでアトミックに行われる
+- バッチの書き込みに失敗した場合は1件ずつ書き込み直し、失敗したドリルだけを失敗扱いにする
+- submit が返す Future で、そのドリルの書き込み完了（または失敗）を待てる
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.learning import prepare_drill_for_learning
+from app.observability import stage
+from app.storage import DrillItem, LearningStore, get_learning_store
+
+
+logger = logging.getLogger(__name__)
+
+WRITER_MAX_PENDING = 1024  # キューに保持する最大ドリル数
+WRITER_BATCH_SIZE = 32  # 1トランザクションで書き込む最大ドリル数
+
+DrillKey = Tuple[Optional[str], str]  # (user_id, drillId)
+
+
+class WriterQueueFull(Exception):
+    """書き込みキューが上限に達している"""
+
+
+def _resolve(future: Future, error: Optional[BaseException] = None) -> None:
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class LearningWriter:
+    """(user_id, drillId) 単位で保存をまとめるバックグラウンドライター"""
+
+    def __init__(
+        self,
+        prepare: Callable[[Any], Dict[str, Any]],
+        store_getter: Callable[[], LearningStore] = get_learning_store,
+        max_pending: int = WRITER_MAX_PENDING,
+        batch_size: int = WRITER_BATCH_SIZE,
+    ):
+        self._prepare = prepare
+        self._store_getter = store_getter
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+
+        self._cond = threading.Condition()
+        # キー → (データ, 受付時刻, 書き込み完了を通知する Future)
+        self._pending: "OrderedDict[DrillKey, Tuple[Any, float, Future]]" = OrderedDict()
+        self._in_flight = 0
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+        self._submitted = 0
+        self._coalesced = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._last_wait_ms = 0.0
+
+    def submit(self, key: DrillKey, drill: Any) -> Tuple[bool, "Future[None]"]:
+        """
+        ドリルを書き込みキューに追加
+
+        Returns:
+            (既にキュー内にあり置き換えたか, 書き込みが終わると完了する Future)。
+            Future は書き込みに失敗した場合はその例外で完了する
+        """
+        with self._cond:
+            self._ensure_started()
+            if key in self._pending:
+                # 受付時刻は最初のものを維持（待ち時間の計測用）。置き換えた内容は同じ書き込みで保存される
+                _, enqueued_at, future = self._pending[key]
+                self._pending[key] = (drill, enqueued_at, future)
+                self._coalesced += 1
+                self._submitted += 1
+                return True, future
+            if len(self._pending) >= self.max_pending:
+                raise WriterQueueFull(f"書き込みキューが上限（{self.max_pending}件）に達しています")
+            future: "Future[None]" = Future()
+            self._pending[key] = (drill, time.perf_counter(), future)
+            self._submitted += 1
+            self._cond.notify()
+            return False, future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """キューが空になり書き込み中のバッチが終わるまで待つ。タイムアウトした場合は False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and self._in_flight == 0, timeout)
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """残りを書き込んでからスレッドを停止する"""
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+            self._stopping = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "queueDepth": len(self._pending),
+                "inFlight": self._in_flight,
+                "maxPending": self.max_pending,
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "written": self._written,
+                "failed": self._failed,
+                "batches": self._batches,
+                "lastFlushMs": self._last_flush_ms,
+                "avgFlushMs": self._total_flush_ms / self._batches if self._batches else 0.0,
+                "maxFlushMs": self._max_flush_ms,
+                "lastQueueWaitMs": self._last_wait_ms,
+            }
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="learning-writer", daemon=True)
+            self._thread.start()
+
+    def _take_batch(self) -> List[Tuple[DrillKey, Any, float, Future]]:
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            key, (drill, enqueued_at, future) = self._pending.popitem(last=False)
+            # 書き込み中の Future はキャンセルできないようにする（キャンセル済みでも書き込みは行う）
+            future.set_running_or_notify_cancel()
+            batch.append((key, drill, enqueued_at, future))
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                if not self._pending and self._stopping:
+                    return
+                batch = self._take_batch()
+                self._in_flight = len(batch)
+
+            try:
+                with stage("learning.writer_flush"):
+                    self._write_batch(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _write_batch(self, batch: List[Tuple[DrillKey, Any, float, Future]]) -> None:
+        started = time.perf_counter()
+        items: List[DrillItem] = []
+        futures: List[Future] = []
+        failed = 0
+        for (user_id, drill_id), drill, _, future in batch:
+            try:
+                with stage("learning.prepare"):
+                    record = self._prepare(drill)
+            except Exception as e:
+                logger.exception("学習データの特徴量計算に失敗しました: userId=%s drillId=%s", user_id, drill_id)
+                _resolve(future, e)
+                failed += 1
+                continue
+            items.append((record, user_id))
+            futures.append(future)
+
+        written = 0
+        if items:
+            try:
+                with stage("learning.store_write"):
+                    written = self._store_getter().save_drills(items)
+                for future in futures:
+                    _resolve(future)
+            except Exception:
+                # 1件の不正なデータでバッチ全体が失われないよう、1件ずつ書き込み直す
+                logger.warning(
+                    "学習データのバッチ書き込みに失敗、1件ずつ再試行します（%d件）", len(items), exc_info=True
+                )
+                for item, future in zip(items, futures):
+                    try:
+                        with stage("learning.store_write"):
+                            written += self._store_getter().save_drills([item])
+                        _resolve(future)
+                    except Exception as e:
+                        logger.exception(
+                            "学習データの書き込みに失敗しました: userId=%s drillId=%s", item[1], item[0].get("drillId")
+                        )
+                        _resolve(future, e)
+                        failed += 1
+
+        finished = time.perf_counter()
+        flush_ms = (finished - started) * 1000
+        with self._cond:
+            self._written += written
+            self._failed += failed
+            self._batches += 1
+            self._last_flush_ms = flush_ms
+            self._total_flush_ms += flush_ms
+            self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+            self._last_wait_ms = (finished - min(enqueued_at for _, _, enqueued_at, _ in batch)) * 1000
+
+
+_writer: Optional[LearningWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_learning_writer() -> LearningWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LearningWriter(prepare_drill_for_learning)
+    return _writer
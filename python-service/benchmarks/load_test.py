@@ -0,0 +1,354 @@
+"""
+エンドポイントの負荷テスト・レイテンシ計測
+
+ASGIアプリをプロセス内で直接呼び出す（デフォルト）か、--url で起動済みのサーバーに対して
+リクエストを送り、スループットと p50 / p95 / p99 レイテンシを出力する。
+
+使い方（python-service ディレクトリで実行）:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --scenarios formation,path --members 20,200,1000
+    python -m benchmarks.load_test --scenarios learning --sets 20,100 --corpus 0,1000
+    python -m benchmarks.load_test --scenarios music --track-seconds 30,180 --requests 20
+    python -m benchmarks.load_test --url http://localhost:8000 --concurrency 16 --json result.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import wave
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+
+# ==================== ペイロード生成 ====================
+
+def formation_payload(members: int) -> Dict[str, Any]:
+    parts = {"trumpet": members // 2, "trombone": members - members // 2}
+    return {"member_count": members, "part_distribution": parts, "shape": random.choice(["circle", "line", "v", "grid"])}
+
+
+def path_payload(members: int) -> Dict[str, Any]:
+    return {
+        "current_positions": [
+            {"x": random.uniform(-50, 50), "y": random.uniform(-30, 30), "member_id": i} for i in range(members)
+        ],
+        "target_positions": [
+            {"x": random.uniform(-50, 50), "y": random.uniform(-30, 30), "member_id": i} for i in range(members)
+        ],
+    }
+
+
+def drill_payload(drill_id: str, sets: int, members: int, user_id: Optional[str] = None) -> Dict[str, Any]:
+    sections = ["intro", "verse", "chorus", "bridge", "outro"]
+    return {
+        "drillId": drill_id,
+        "userId": user_id,
+        "title": f"bench {drill_id}",
+        "metadata": {"createdAt": "2025-01-01T00:00:00Z"},
+        "members": [{"id": f"M{m}", "name": f"Member {m}", "part": "Trumpet"} for m in range(members)],
+        "sets": [
+            {
+                "id": f"set-{s}",
+                "startCount": s * 8,
+                "section": sections[s * len(sections) // max(sets, 1)],
+                "positions": {
+                    f"M{m}": {"x": random.uniform(-50, 50), "y": random.uniform(-30, 30)} for m in range(members)
+                },
+            }
+            for s in range(sets)
+        ],
+    }
+
+
+def wav_payload(seconds: float, bpm: float = 120.0, sr: int = 22050) -> bytes:
+    """指定BPMのクリック音を含むモノラルWAV"""
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    signal = 0.05 * np.sin(2 * np.pi * 220 * t)
+    click = np.sin(2 * np.pi * 1000 * np.arange(int(0.03 * sr)) / sr) * np.hanning(int(0.03 * sr))
+    for start in np.arange(0, seconds, 60.0 / bpm):
+        i = int(start * sr)
+        signal[i:i + len(click)] += click[:max(0, n - i)]
+    pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+
+# ==================== 実行・集計 ====================
+
+@dataclass
+class Result:
+    scenario: str
+    params: Dict[str, Any]
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+    status_codes: Dict[str, int] = field(default_factory=dict)
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return float(np.percentile(sorted_values, q))
+
+
+async def run_load(
+    name: str,
+    params: Dict[str, Any],
+    send: Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]],
+    client: httpx.AsyncClient,
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> Result:
+    """send を requests 回、concurrency 並列で実行して集計"""
+    for i in range(warmup):
+        await send(client, -1 - i)
+
+    latencies: List[float] = []
+    status_codes: Dict[str, int] = {}
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await send(client, i)
+                code = str(response.status_code)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception as e:
+                code = type(e).__name__
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            status_codes[code] = status_codes.get(code, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ms = sorted(v * 1000 for v in latencies)
+    return Result(
+        scenario=name,
+        params=params,
+        requests=len(ms),
+        errors=errors,
+        seconds=elapsed,
+        throughput=len(ms) / elapsed if elapsed > 0 else 0.0,
+        p50_ms=_percentile(ms, 50),
+        p95_ms=_percentile(ms, 95),
+        p99_ms=_percentile(ms, 99),
+        mean_ms=statistics.fmean(ms) if ms else 0.0,
+        status_codes=status_codes,
+    )
+
+
+async def wait_for_writer(client: httpx.AsyncClient, timeout: float = 300.0) -> None:
+    """学習データの書き込みキューが空になるまで待つ"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        stats = (await client.get("/learning/writer")).json()
+        if stats["queueDepth"] == 0 and stats["inFlight"] == 0:
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError("学習データの書き込みが終わりません")
+
+
+async def seed_corpus(client: httpx.AsyncClient, drills: int, sets: int, members: int) -> None:
+    """/learning/import で学習データを投入"""
+    if drills <= 0:
+        return
+    body = "\n".join(
+        json.dumps(drill_payload(f"seed-{i}", sets, members, user_id=f"user-{i % 10}")) for i in range(drills)
+    )
+    response = await client.post("/learning/import", content=body.encode(), timeout=None)
+    response.raise_for_status()
+
+
+# ==================== シナリオ ====================
+
+async def bench_formation(client, args) -> List[Result]:
+    results = []
+    for members in args.members:
+        async def send(c, i, members=members):
+            return await c.post("/formation/generate", json=formation_payload(members))
+        results.append(await run_load("formation", {"members": members}, send, client, args.requests, args.concurrency, args.warmup))
+    return results
+
+
+async def bench_path(client, args) -> List[Result]:
+    results = []
+    for members in args.members:
+        payloads = [path_payload(members) for _ in range(min(args.requests, 50))]
+
+        async def send(c, i, payloads=payloads):
+            return await c.post("/path/optimize", json=payloads[i % len(payloads)])
+        results.append(await run_load("path", {"members": members}, send, client, args.requests, args.concurrency, args.warmup))
+    return results
+
+
+async def bench_learning(client, args) -> List[Result]:
+    results = []
+    members = args.members[0]
+    for corpus in args.corpus:
+        for sets in args.sets:
+            await seed_corpus(client, corpus, sets, members)
+            await wait_for_writer(client)
+            payloads = [drill_payload("bench", sets, members, user_id="bench") for _ in range(min(args.requests, 50))]
+            run_id = f"c{corpus}-s{sets}"
+
+            # drillIdは毎回変える（同じIDだと書き込み前に合流され、実際の書き込み量を測れない）
+            async def save(c, i, payloads=payloads, run_id=run_id):
+                payload = dict(payloads[i % len(payloads)], drillId=f"bench-{run_id}-{i}")
+                return await c.post("/learning/save-drill", json=payload)
+            params = {"corpus": corpus, "sets": sets, "members": members}
+            # ウォームアップの保存は計測区間の外で書き込みまで終わらせ、書き込み件数に含めない
+            for i in range(args.warmup):
+                await save(client, -1 - i)
+            await wait_for_writer(client)
+            before = (await client.get("/learning/writer")).json()
+            started = time.perf_counter()
+            result = await run_load("learning.save-drill", params, save, client, args.requests, args.concurrency, 0)
+            # 受け付けだけでなく、キューが空になるまで（書き込み完了まで）の時間で書き込みスループットを出す
+            drain_started = time.perf_counter()
+            await wait_for_writer(client)
+            finished = time.perf_counter()
+            elapsed = finished - started
+            after = (await client.get("/learning/writer")).json()
+            written = after["written"] - before["written"]
+            batches = after["batches"] - before["batches"]
+            result.extra = {
+                "drainSeconds": finished - drain_started,
+                "written": written,
+                "coalesced": after["coalesced"] - before["coalesced"],
+                "failed": after["failed"] - before["failed"],
+                "writesPerSec": written / elapsed if elapsed > 0 else 0.0,
+                "avgFlushMs": (
+                    (after["avgFlushMs"] * after["batches"] - before["avgFlushMs"] * before["batches"]) / batches
+                    if batches else 0.0
+                ),
+            }
+            results.append(result)
+
+            async def patterns(c, i):
+                user_id = None if i % 2 else f"user-{i % 10}"
+                return await c.get("/learning/patterns", params={"user_id": user_id} if user_id else None)
+            results.append(await run_load("learning.patterns", params, patterns, client, args.requests, args.concurrency, args.warmup))
+    return results
+
+
+async def bench_music(client, args) -> List[Result]:
+    results = []
+    for seconds in args.track_seconds:
+        audio = wav_payload(seconds)
+        for mode in ("quick", "full"):
+            async def send(c, i, mode=mode):
+                return await c.post(
+                    "/music/analyze", files={"file": ("bench.wav", audio, "audio/wav")}, data={"mode": mode}, timeout=None
+                )
+            requests = max(1, args.requests // 10)  # 音楽解析は重いので回数を減らす
+            results.append(await run_load(
+                "music.analyze", {"seconds": seconds, "mode": mode}, send, client, requests, min(args.concurrency, requests), 1
+            ))
+    return results
+
+
+SCENARIOS = {
+    "formation": bench_formation,
+    "path": bench_path,
+    "learning": bench_learning,
+    "music": bench_music,
+}
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def _float_list(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def print_results(results: List[Result]) -> None:
+    header = f"{'scenario':<22}{'params':<38}{'req':>6}{'err':>5}{'req/s':>9}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        params = " ".join(f"{k}={v}" for k, v in r.params.items())
+        print(
+            f"{r.scenario:<22}{params:<38}{r.requests:>6}{r.errors:>5}"
+            f"{r.throughput:>9.1f}{r.p50_ms:>9.2f}{r.p95_ms:>9.2f}{r.p99_ms:>9.2f}"
+        )
+        if r.extra:
+            print("  " + " ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in r.extra.items()))
+
+
+async def main_async(args) -> List[Result]:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60.0)
+    else:
+        # プロセス内実行では学習データを一時ディレクトリに保存する（既存データを汚さない）
+        if "LEARNING_DB_PATH" not in os.environ:
+            os.environ["LEARNING_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="drill-bench-"), "learning.db")
+        from app.main import app
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60.0)
+
+    results: List[Result] = []
+    async with client:
+        for name in args.scenarios:
+            results.extend(await SCENARIOS[name](client, args))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Drill Python Service の負荷テスト")
+    parser.add_argument("--url", help="起動済みサーバーのURL（省略時はプロセス内でASGIアプリを直接呼び出す）")
+    parser.add_argument("--scenarios", default="formation,path,learning,music", help=f"実行するシナリオ（{','.join(SCENARIOS)}）")
+    parser.add_argument("--members", type=_int_list, default=[20, 100, 500], help="メンバー数（カンマ区切り）")
+    parser.add_argument("--sets", type=_int_list, default=[20, 100], help="1ドリルあたりのセット数（learning）")
+    parser.add_argument("--corpus", type=_int_list, default=[0, 500], help="事前に投入するドリル数（learning、累積）")
+    parser.add_argument("--track-seconds", type=_float_list, default=[30.0, 180.0], help="音声の長さ（秒、music）")
+    parser.add_argument("--requests", type=int, default=200, help="1計測あたりのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時リクエスト数")
+    parser.add_argument("--warmup", type=int, default=5, help="計測前のウォームアップ回数")
+    parser.add_argument("--seed", type=int, default=0, help="ペイロード生成の乱数シード")
+    parser.add_argument("--json", dest="json_path", help="結果をJSONで保存するパス")
+    args = parser.parse_args()
+
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    results = asyncio.run(main_async(args))
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(r) for r in results], f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
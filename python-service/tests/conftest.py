@@ -0,0 +1,75 @@
+import random
+from typing import Any, Dict, Optional
+
+import pytest
+
+from app import storage
+from app.learning import DrillData, prepare_drill_for_learning
+from app.storage import FileLearningStore, SQLiteLearningStore
+
+
+def make_drill(
+    drill_id: str,
+    user_id: Optional[str] = None,
+    sets: int = 4,
+    members: int = 8,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """テスト用のドリルデータ（API に送る形式）を作る。途中のセットでは1人抜けている"""
+    rng = random.Random(seed)
+    sections = ["intro", "verse", "chorus", "outro"]
+    drill_sets = []
+    for i in range(sets):
+        positions = {
+            f"M{j}": {"x": rng.uniform(-40, 40), "y": rng.uniform(-20, 20)}
+            for j in range(members)
+            if not (i % 2 == 1 and j == members - 1)
+        }
+        drill_sets.append({
+            "id": f"set-{i}",
+            "startCount": i * 16.0,
+            "section": sections[i % len(sections)],
+            "positions": positions,
+        })
+    return {
+        "drillId": drill_id,
+        "userId": user_id,
+        "title": f"Drill {drill_id}",
+        "metadata": {},
+        "members": [{"id": f"M{j}"} for j in range(members)],
+        "sets": drill_sets,
+    }
+
+
+def prepared(drill_id: str, user_id: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+    """特徴量・遷移・形状記述子を計算済みの、ストアに保存する形式のドリル"""
+    return prepare_drill_for_learning(DrillData.model_validate(make_drill(drill_id, user_id, **kwargs)))
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FileLearningStore(tmp_path / "learning")
+    return SQLiteLearningStore(tmp_path / "learning.db")
+
+
+@pytest.fixture
+def active_store(tmp_path, monkeypatch):
+    """get_learning_store() が返すストアを一時ディレクトリのSQLiteストアに差し替える"""
+    active = SQLiteLearningStore(tmp_path / "learning.db")
+    monkeypatch.setattr(storage, "_store", active)
+    return active
+
+
+@pytest.fixture
+def client(active_store, monkeypatch):
+    """一時ストアを使うアプリの TestClient（起動・終了イベントも実行する）"""
+    from fastapi.testclient import TestClient
+
+    from app import similarity, writer
+    from app.main import app
+
+    monkeypatch.setattr(similarity, "_index", None)
+    monkeypatch.setattr(writer, "_writer", None)
+    with TestClient(app) as test_client:
+        yield test_client
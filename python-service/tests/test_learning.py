@@ -0,0 +1,151 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.learning import (
+    DrillData,
+    calculate_features,
+    calculate_features_batch,
+    calculate_formation_type,
+    calculate_formation_types,
+    calculate_transition,
+    calculate_transitions,
+    drill_to_array,
+    prepare_drill_for_learning,
+)
+from app.similarity import compute_descriptors
+
+from tests.conftest import make_drill
+
+
+# ---- 1セットずつ計算していた頃の実装（ベクトル化した実装と結果が一致することを確認する） ----
+
+def scalar_formation_type(positions):
+    if len(positions) < 3:
+        return "custom"
+    xs = [p["x"] for p in positions.values()]
+    ys = [p["y"] for p in positions.values()]
+    cx, cy = np.mean(xs), np.mean(ys)
+    distances = [np.sqrt((x - cx) ** 2 + (y - cy) ** 2) for x, y in zip(xs, ys)]
+    if np.std(distances) / (np.mean(distances) + 1e-6) < 0.3:
+        return "circle"
+    std_x, std_y = np.std(xs), np.std(ys)
+    if std_x / (std_y + 1e-6) < 0.3 or std_y / (std_x + 1e-6) < 0.3:
+        return "line"
+    if std_x > 0 and std_y > 0:
+        return "grid"
+    return "custom"
+
+
+def scalar_spread(positions):
+    if len(positions) < 2:
+        return 0.0
+    xs = [p["x"] for p in positions.values()]
+    ys = [p["y"] for p in positions.values()]
+    cx, cy = np.mean(xs), np.mean(ys)
+    return float(np.mean([np.sqrt((x - cx) ** 2 + (y - cy) ** 2) for x, y in zip(xs, ys)]))
+
+
+def scalar_transition(from_positions, to_positions):
+    common = set(from_positions) & set(to_positions)
+    if not common:
+        return None
+    distances = [
+        np.hypot(to_positions[m]["x"] - from_positions[m]["x"], to_positions[m]["y"] - from_positions[m]["y"])
+        for m in common
+    ]
+    return float(np.max(distances)), float(np.mean(distances))
+
+
+def random_positions(rng, members, drop=0.0):
+    return {
+        f"M{j}": {"x": rng.uniform(-50, 50), "y": rng.uniform(-30, 30)}
+        for j in range(members)
+        if rng.random() >= drop
+    }
+
+
+def sample_sets():
+    rng = random.Random(42)
+    sets = [random_positions(rng, n, drop=0.2) for n in (0, 1, 2, 3, 10, 40, 40, 120)]
+    sets.append({f"M{j}": {"x": 10 * np.cos(j / 6 * np.pi), "y": 10 * np.sin(j / 6 * np.pi)} for j in range(12)})
+    sets.append({f"M{j}": {"x": float(j), "y": 0.0} for j in range(8)})
+    sets.append({f"M{j}": {"x": float(j % 4), "y": float(j // 4)} for j in range(16)})
+    sets.append({"M0": {"x": 1.0, "y": 1.0}, "M1": {"x": 1.0, "y": 1.0}, "M2": {"x": 1.0, "y": 1.0}})
+    return sets
+
+
+def test_batch_features_match_scalar():
+    sets = sample_sets()
+    _, coords, valid = drill_to_array(sets)
+
+    types = calculate_formation_types(coords, valid)
+    features = calculate_features_batch(coords, valid)
+
+    assert types == [scalar_formation_type(p) for p in sets]
+    assert "circle" in types and "line" in types and "grid" in types
+    for positions, set_features in zip(sets, features):
+        assert set_features["spread"] == pytest.approx(scalar_spread(positions), abs=1e-9)
+        assert set_features["symmetry"] == (0.0 if len(positions) < 2 else 0.5)
+        assert set_features["rotation"] == 0.0
+    # 1セット版のAPIも同じ結果を返す
+    assert [calculate_formation_type(p) for p in sets] == types
+    for positions, set_features in zip(sets, features):
+        assert calculate_features(positions) == pytest.approx(set_features)
+
+
+def test_batch_transitions_match_scalar():
+    sets = sample_sets()
+    _, coords, valid = drill_to_array(sets)
+    durations = [float(i + 1) for i in range(len(sets) - 1)]
+
+    transitions = calculate_transitions(coords, valid, durations)
+
+    assert len(transitions) == len(sets) - 1
+    for i, transition in enumerate(transitions):
+        assert transition.duration == durations[i]
+        expected = scalar_transition(sets[i], sets[i + 1])
+        if expected is None:
+            assert transition.movementType == "unknown"
+            assert transition.avgDistance is None
+            continue
+        assert transition.maxDistance == pytest.approx(expected[0], abs=1e-9)
+        assert transition.avgDistance == pytest.approx(expected[1], abs=1e-9)
+        single = calculate_transition(sets[i], sets[i + 1], durations[i])
+        assert single.movementType == transition.movementType
+        assert single.avgDistance == pytest.approx(transition.avgDistance)
+
+
+def test_prepare_drill_fills_sets_and_transitions():
+    record = prepare_drill_for_learning(DrillData.model_validate(make_drill("d1", sets=5)))
+
+    assert len(record["transitions"]) == 4
+    assert [(t["fromSetId"], t["toSetId"]) for t in record["transitions"]][0] == ("set-0", "set-1")
+    for set_data in record["sets"]:
+        assert set_data["formationType"] == scalar_formation_type(set_data["positions"])
+        assert set_data["features"]["spread"] == pytest.approx(scalar_spread(set_data["positions"]))
+        assert len(set_data["descriptor"]) > 0
+
+
+def test_positions_require_x_and_y():
+    drill = make_drill("d1")
+    del drill["sets"][0]["positions"]["M0"]["y"]
+    with pytest.raises(ValueError, match="M0"):
+        DrillData.model_validate(drill)
+
+
+def test_descriptor_is_invariant_to_order_and_placement():
+    rng = np.random.default_rng(0)
+    base = rng.uniform(-20, 20, size=(300, 2))
+    angle = 0.7
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    moved = base @ rotation.T * 2.5 + [13.0, -4.0]
+    shuffled = base[rng.permutation(len(base))]
+
+    coords = np.stack([base, moved, shuffled])
+    descriptors = compute_descriptors(coords, np.ones(coords.shape[:2], dtype=bool))
+
+    unit = descriptors / np.linalg.norm(descriptors, axis=1, keepdims=True)
+    assert unit[0] @ unit[1] > 0.999
+    np.testing.assert_allclose(descriptors[0], descriptors[2], atol=1e-6)
@@ -0,0 +1,161 @@
+import numpy as np
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from app.live_beats import LiveBeatTracker, decode_pcm
+
+
+def click_track(bpm, sample_rate, seconds=12.0, first=0.5):
+    """first 秒から bpm 間隔で短いクリック（減衰するノイズ）を鳴らす音声と、クリックの時刻"""
+    rng = np.random.default_rng(0)
+    audio = np.zeros(int(seconds * sample_rate), dtype=np.float32)
+    length = int(0.01 * sample_rate)
+    click = rng.standard_normal(length) * np.exp(-np.arange(length) / (0.002 * sample_rate)) * 0.8
+    times = np.arange(first, seconds - 0.1, 60.0 / bpm)
+    for t in times:
+        start = int(round(t * sample_rate))
+        audio[start:start + length] += click[:len(audio) - start]
+    return audio, times
+
+
+def stream(tracker, audio, chunk_seconds=0.1):
+    beats = []
+    step = int(chunk_seconds * tracker.sample_rate)
+    for i in range(0, len(audio), step):
+        event = tracker.push(audio[i:i + step])
+        if event is not None:
+            beats.extend(event["beats"])
+    return np.array(beats)
+
+
+@pytest.mark.parametrize("sample_rate", [22050, 44100])
+@pytest.mark.parametrize("bpm", [90, 120, 137])
+def test_beat_times_follow_clicks(bpm, sample_rate):
+    audio, clicks = click_track(bpm, sample_rate)
+    tracker = LiveBeatTracker(sample_rate)
+
+    beats = stream(tracker, audio)
+    # 最初のクリックより前（無音部分）に延長された拍は対象外
+    beats = beats[beats > clicks[0] - 30.0 / bpm]
+
+    assert len(beats) >= len(clicks) - 2
+    errors = np.array([beat - clicks[np.argmin(np.abs(clicks - beat))] for beat in beats])
+    # 1フレーム（hop_length / sr）以内。以前は窓の先頭の時刻を使っていたため50〜80ms早かった
+    assert np.abs(errors).max() < 0.025
+    assert abs(np.median(errors)) < 0.012
+    assert tracker.bpm == pytest.approx(bpm, rel=0.02)
+
+
+def test_start_time_and_current_time():
+    sample_rate = 22050
+    audio, clicks = click_track(120, sample_rate, seconds=6.0)
+    tracker = LiveBeatTracker(sample_rate, start_time=30.0)
+
+    beats = stream(tracker, audio, chunk_seconds=0.037)
+
+    assert tracker.current_time == pytest.approx(36.0)
+    assert np.abs(beats - 30.0 - clicks[np.argmin(np.abs(clicks[None, :] + 30.0 - beats[:, None]), axis=1)]).max() < 0.025
+
+    tracker.reset(10.0)
+    assert tracker.current_time == 10.0
+    assert tracker.bpm is None
+
+
+def server_events(tracker, chunks):
+    """サーバーと同じ入力をローカルのトラッカーに通し、返るはずのイベントを求める"""
+    return [event for event in (tracker.push(chunk) for chunk in chunks) if event is not None]
+
+
+def test_stream_protocol_reports_beats(client):
+    sample_rate = 22050
+    audio, clicks = click_track(120, sample_rate, seconds=6.0)
+    pcm = (np.clip(audio, -1, 1) * 32767).astype("<i2")
+    chunks = [pcm[i:i + 2205] for i in range(0, len(pcm), 2205)]
+    expected = server_events(LiveBeatTracker(sample_rate), [decode_pcm(c.tobytes(), "s16le", 1) for c in chunks])
+
+    with client.websocket_connect("/music/stream") as ws:
+        ws.send_json({"sample_rate": sample_rate, "format": "s16le", "channels": 1})
+        assert ws.receive_json() == {"type": "ready", "sample_rate": sample_rate, "format": "s16le", "channels": 1}
+        for chunk in chunks:
+            ws.send_bytes(chunk.tobytes())
+        events = [ws.receive_json() for _ in expected]
+
+    assert len(expected) >= 5
+    assert all(event.keys() == {"type", "beats", "bpm", "bpmRaw", "time"} for event in events)
+    assert [event["time"] for event in events] == pytest.approx([event["time"] for event in expected])
+    assert events[-1]["bpm"] == pytest.approx(120, rel=0.02)
+    beats = np.array([beat for event in events for beat in event["beats"]])
+    beats = beats[beats > clicks[0] - 0.25]
+    assert len(beats) >= 8
+    assert np.abs(beats[:, None] - clicks[None, :]).min(axis=1).max() < 0.025
+
+
+def test_stream_stereo_float_and_reset(client):
+    sample_rate = 44100
+    audio, clicks = click_track(100, sample_rate, seconds=5.0)
+    stereo = np.repeat(audio[:, None], 2, axis=1).astype("<f4")
+    chunks = [stereo[i:i + sample_rate // 4] for i in range(0, len(stereo), sample_rate // 4)]
+    mirror = LiveBeatTracker(sample_rate)
+    mirror.reset(60.0)
+    expected = server_events(mirror, [decode_pcm(c.tobytes(), "f32le", 2) for c in chunks])
+
+    with client.websocket_connect("/music/stream") as ws:
+        ws.send_json({"sample_rate": sample_rate, "format": "f32le", "channels": 2})
+        assert ws.receive_json()["type"] == "ready"
+        # シーク後の再生位置から数える
+        ws.send_json({"type": "reset", "time": 60.0})
+        for chunk in chunks:
+            ws.send_bytes(chunk.tobytes())
+        events = [ws.receive_json() for _ in expected]
+
+    assert len(expected) >= 3
+    assert events[-1]["time"] == pytest.approx(expected[-1]["time"])
+    assert events[-1]["time"] > 64.0
+    beats = np.array([beat for event in events for beat in event["beats"]]) - 60.0
+    beats = beats[beats > clicks[0] - 0.3]
+    assert len(beats) >= 4
+    assert np.abs(beats[:, None] - clicks[None, :]).min(axis=1).max() < 0.025
+
+
+def test_stream_rejects_bad_messages(client):
+    with client.websocket_connect("/music/stream") as ws:
+        for message in ["{not json", "[1, 2]", '"text"', '{"type": "reset", "time": "abc"}', '{"type": "reset", "time": -1}']:
+            ws.send_text(message)
+            assert ws.receive_json()["type"] == "error"
+        ws.send_json({"sample_rate": 8000})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"sample_rate": 16000})
+        assert ws.receive_json() == {"type": "error", "detail": "設定はストリーム開始前に送ってください"}
+        ws.send_bytes(np.zeros(8000 * 6, dtype="<f4").tobytes())
+        assert ws.receive_json() == {"type": "error", "detail": "チャンクが大きすぎます"}
+
+
+@pytest.mark.parametrize("config", [
+    {"sample_rate": "fast"},
+    {"sample_rate": 1000},
+    {"sample_rate": None},
+    {"channels": "2"},
+    {"channels": True},
+    {"channels": 1.5},
+    {"channels": 9},
+    {"format": "mp3"},
+    {"format": ["f32le"]},
+])
+def test_stream_rejects_bad_config(client, config):
+    with client.websocket_connect("/music/stream") as ws:
+        ws.send_json(config)
+        assert ws.receive_json() == {"type": "error", "detail": "sample_rate / format / channels が不正です"}
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            ws.receive_json()
+    assert disconnect.value.code == 1003
+
+
+def test_stream_limits_concurrent_streams(client, monkeypatch):
+    from app import main
+
+    monkeypatch.setattr(main, "LIVE_MAX_STREAMS", 0)
+    with client.websocket_connect("/music/stream") as ws:
+        assert ws.receive_json()["type"] == "error"
+        with pytest.raises(WebSocketDisconnect) as disconnect:
+            ws.receive_json()
+    assert disconnect.value.code == 1013
@@ -0,0 +1,84 @@
+import json
+import logging
+import math
+
+from app.observability import Counter, Gauge, Histogram, JsonLogFormatter, log_fields, server_timing_header
+
+
+def test_histogram_render():
+    histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(123456.789012, "a")
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="a",le="0.1"} 1',
+        'test_seconds_bucket{stage="a",le="1"} 2',
+        'test_seconds_bucket{stage="a",le="+Inf"} 3',
+        f'test_seconds_sum{{stage="a"}} {0.05 + 0.5 + 123456.789012!r}',
+        'test_seconds_count{stage="a"} 3',
+    ]
+
+
+def test_counter_and_gauge_values_keep_precision():
+    counter = Counter("test_total", "Test.", ("kind",))
+    counter.inc("big", amount=1234567)
+    counter.inc("fraction", amount=0.1234567891)
+    counter.inc('quote"d')
+
+    assert counter.render()[2:] == [
+        'test_total{kind="big"} 1234567',
+        'test_total{kind="fraction"} 0.1234567891',
+        'test_total{kind="quote\\"d"} 1',
+    ]
+    assert Gauge("test_gauge", "Test.", lambda: math.nan).render()[-1] == "test_gauge NaN"
+    assert Gauge("test_gauge", "Test.", lambda: -math.inf).render()[-1] == "test_gauge -Inf"
+    assert Gauge("test_gauge", "Test.", lambda: 2.0 ** 60).render()[-1] == f"test_gauge {2.0 ** 60!r}"
+
+
+def test_server_timing_header_merges_repeated_stages():
+    header = server_timing_header([("a", 0.001), ("b", 0.002), ("a", 0.0005)], 0.01)
+    assert header == "a;dur=1.50, b;dur=2.00, total;dur=10.00"
+
+
+def test_log_fields_can_use_reserved_names():
+    logger = logging.getLogger("tests.observability")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        logger.info("アップロード", extra=log_fields(filename="song.wav", module="music", bytes=10))
+    finally:
+        logger.removeHandler(handler)
+
+    payload = json.loads(JsonLogFormatter().format(records[0]))
+    assert payload["message"] == "アップロード"
+    # extra= に直接渡すと KeyError になる LogRecord の属性名も、項目としてそのまま出力される
+    assert (payload["filename"], payload["module"], payload["bytes"]) == ("song.wav", "music", 10)
+
+
+def test_server_timing_and_metrics_through_app(client):
+    response = client.post(
+        "/formation/generate", json={"member_count": 30, "part_distribution": {}, "shape": "grid"}
+    )
+    assert response.status_code == 200
+    entries = [entry.split(";dur=") for entry in response.headers["Server-Timing"].split(", ")]
+    assert [name for name, _ in entries] == ["formation.layout", "formation.serialize", "total"]
+    assert all(float(duration) >= 0 for _, duration in entries)
+
+    metrics = client.get("/metrics")
+    assert metrics.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = metrics.text.splitlines()
+    assert any(
+        line.startswith('drill_http_request_duration_seconds_count{method="POST",route="/formation/generate",status="200"} ')
+        for line in lines
+    )
+    assert any(line.startswith('drill_stage_duration_seconds_bucket{stage="formation.layout",le="+Inf"} ') for line in lines)
+    assert "# TYPE drill_learning_writer_written_total counter" in lines
+    for line in lines:
+        if line and not line.startswith("#"):
+            float(line.rsplit(" ", 1)[1])
@@ -0,0 +1,90 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from app import responses
+from app.main import FormationResult, PathOptimizationResult
+
+
+def reference_layout(shape, n):
+    """メンバーごとにループしていた以前の配置計算"""
+    if shape == "circle":
+        radius = min(n * 0.5, 20.0)
+        return [(radius * math.cos(i * 2 * math.pi / n), radius * math.sin(i * 2 * math.pi / n)) for i in range(n)]
+    if shape == "line":
+        return [(-(n - 1) * 2.0 / 2 + i * 2.0, 0.0) for i in range(n)]
+    if shape == "v":
+        return [((i - n // 2) * 2.0, abs(i - n // 2) * 1.5) for i in range(n)]
+    if shape == "grid":
+        cols = math.ceil(math.sqrt(n))
+        rows = math.ceil(n / cols)
+        return [(-(cols - 1) * 2.5 / 2 + (i % cols) * 2.5, -(rows - 1) * 2.5 / 2 + (i // cols) * 2.5) for i in range(n)]
+    np.random.seed(42)
+    return [(np.random.uniform(-10, 10), np.random.uniform(-10, 10)) for _ in range(n)]
+
+
+@pytest.mark.parametrize("member_count", [1, 7, 64])
+@pytest.mark.parametrize("shape", ["circle", "line", "v", "grid", "custom"])
+def test_formation_response_matches_model(client, shape, member_count):
+    response = client.post("/formation/generate", json={
+        "member_count": member_count,
+        "part_distribution": {"trumpet": member_count},
+        "shape": shape,
+    })
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    result = FormationResult.model_validate(response.json())
+    assert result.shape == shape
+    assert result.total_members == member_count
+    assert [p.member_index for p in result.positions] == list(range(member_count))
+    expected = reference_layout(shape, member_count)
+    assert [p.x for p in result.positions] == pytest.approx([x for x, _ in expected], abs=1e-9)
+    assert [p.y for p in result.positions] == pytest.approx([y for _, y in expected], abs=1e-9)
+
+
+def test_path_response_matches_model(client):
+    response = client.post("/path/optimize", json={
+        "current_positions": [{"x": 0, "y": 0, "member_id": 5}, {"x": 1.5, "y": -2}, {"x": 3, "y": 4, "member_id": "7"}],
+        "target_positions": [{"x": 3, "y": 4}, {"x": 1.5, "y": -2}, {"x": 0, "y": 0}],
+    })
+
+    assert response.status_code == 200
+    result = PathOptimizationResult.model_validate(response.json())
+    # member_id がない場合は並び順を使う
+    assert [path.member_id for path in result.paths] == [5, 1, 7]
+    assert [(p.x, p.y, p.time) for p in result.paths[1].points] == [(1.5, -2.0, 0.0), (1.5, -2.0, 1.0)]
+    assert result.total_distance == pytest.approx(10.0)
+    assert result.max_distance == pytest.approx(5.0)
+
+
+def test_path_response_without_members(client):
+    response = client.post("/path/optimize", json={"current_positions": [], "target_positions": []})
+
+    assert response.status_code == 200
+    assert PathOptimizationResult.model_validate(response.json()) == PathOptimizationResult(
+        paths=[], total_distance=0.0, max_distance=0.0
+    )
+
+
+def test_dumps_fallback_matches_orjson(monkeypatch):
+    content = {
+        "array": np.arange(3, dtype=np.float32) / 4,
+        "scalar": np.int64(2**40),
+        "text": "フォーメーション",
+        "nested": [{"x": 0.1, "y": None, "ok": True}],
+    }
+    fast = responses.dumps(content)
+
+    monkeypatch.setattr(responses, "ORJSON_AVAILABLE", False)
+    fallback = responses.dumps(content)
+
+    assert json.loads(fallback) == json.loads(fast) == {
+        "array": [0.0, 0.25, 0.5],
+        "scalar": 2**40,
+        "text": "フォーメーション",
+        "nested": [{"x": 0.1, "y": None, "ok": True}],
+    }
+    assert b" " not in fallback
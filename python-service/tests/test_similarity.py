@@ -0,0 +1,135 @@
+import numpy as np
+
+from app import similarity
+from app.similarity import FormationIndex
+
+from tests.conftest import prepared
+
+
+def descriptor(drill, set_index=0):
+    return np.array(drill["sets"][set_index]["descriptor"], dtype=np.float32)
+
+
+def result_keys(results):
+    return {(user_id, drill_id, set_index) for user_id, drill_id, set_index, _ in results}
+
+
+def test_finds_saved_set(store):
+    drills = [prepared(f"d{i}", "alice", seed=i, members=12) for i in range(3)]
+    store.save_drills([(drill, "alice") for drill in drills])
+    index = FormationIndex(store)
+
+    user_id, drill_id, set_index, score = index.search(descriptor(drills[1], 2), k=1)[0]
+
+    assert (user_id, drill_id, set_index) == ("alice", "d1", 2)
+    assert score > 0.999
+    assert len(index) == 12
+
+
+def test_picks_up_new_and_updated_drills(store):
+    store.save_drill(prepared("d1", "alice"), "alice")
+    index = FormationIndex(store)
+    index.refresh()
+    assert len(index) == 4
+
+    # 前回の連番より後の書き込みだけが iter_descriptors(after=...) で取り込まれる
+    added = prepared("d2", "bob", seed=5, sets=3)
+    store.save_drill(added, "bob")
+    assert index.search(descriptor(added, 1), k=1)[0][:3] == ("bob", "d2", 1)
+    assert len(index) == 7
+
+    updated = prepared("d1", "alice", seed=9, sets=2)
+    store.save_drill(updated, "alice")
+    assert index.search(descriptor(updated, 1), k=1)[0][:3] == ("alice", "d1", 1)
+    assert len(index) == 5
+
+
+def test_resave_with_fewer_and_more_sets(store):
+    store.save_drill(prepared("other", "alice", seed=1), "alice")
+    store.save_drill(prepared("d1", "alice", sets=5), "alice")
+    index = FormationIndex(store)
+    index.refresh()
+    assert len(index) == 9
+
+    fewer = prepared("d1", "alice", sets=2, seed=2)
+    store.save_drill(fewer, "alice")
+    index.refresh()
+    assert len(index) == 6
+    assert index._dead == 3
+    assert result_keys(index.search(descriptor(fewer), k=100)) == (
+        {("alice", "other", i) for i in range(4)} | {("alice", "d1", i) for i in range(2)}
+    )
+
+    more = prepared("d1", "alice", sets=7, seed=3)
+    store.save_drill(more, "alice")
+    index.refresh()
+    assert len(index) == 11
+    results = index.search(descriptor(more, 6), k=100)
+    assert results[0][:3] == ("alice", "d1", 6)
+    assert result_keys(results) == {("alice", "other", i) for i in range(4)} | {("alice", "d1", i) for i in range(7)}
+    # 縮めたときに空いた行は再利用されず、再保存を繰り返しても行数は増え続けない
+    for seed in range(4, 10):
+        store.save_drill(prepared("d1", "alice", sets=7, seed=seed), "alice")
+        index.refresh()
+    assert index._size == 4 + 2 + 3 + 5
+    assert len(index) == 11
+
+
+def test_compacts_dead_rows(store):
+    big = similarity.INDEX_COMPACT_MIN_DEAD + 20
+    keep = prepared("keep", "bob", seed=1)
+    store.save_drill(keep, "bob")
+    store.save_drill(prepared("big", "alice", sets=big, members=4), "alice")
+    index = FormationIndex(store)
+    index.refresh()
+    assert len(index) == 4 + big
+
+    small = prepared("big", "alice", sets=2, seed=2)
+    store.save_drill(small, "alice")
+    index.refresh()
+
+    # 無効な行（big - 2）が下限を超え、有効な行より多くなったので詰め直される
+    assert index._dead == 0
+    assert index._size == len(index) == 6
+    assert len(index._vectors) == 1024
+    assert index.search(descriptor(keep, 3), k=1)[0][:3] == ("bob", "keep", 3)
+    assert index.search(descriptor(small, 1), k=1)[0][:3] == ("alice", "big", 1)
+
+    # 詰め直した後の上書き・追加も正しい行を使う
+    store.save_drill(prepared("keep", "bob", seed=3, sets=1), "bob")
+    assert result_keys(index.search(descriptor(small), k=100)) == {("bob", "keep", 0), ("alice", "big", 0), ("alice", "big", 1)}
+
+
+def test_compaction_waits_for_enough_dead_rows(store):
+    store.save_drill(prepared("d1", "alice", sets=10), "alice")
+    index = FormationIndex(store)
+    index.refresh()
+    store.save_drill(prepared("d1", "alice", sets=1), "alice")
+    index.refresh()
+
+    assert index._dead == 9
+    assert index._size == 10
+
+
+def test_exclude_drill_id(store):
+    alice_d1 = prepared("d1", "alice", seed=1)
+    store.save_drills([
+        (alice_d1, "alice"),
+        (prepared("d1", "bob", seed=2), "bob"),
+        (prepared("d2", "alice", seed=3), "alice"),
+        (prepared("d3", seed=4), None),
+    ])
+    index = FormationIndex(store)
+    query = descriptor(alice_d1)
+
+    def drills(results):
+        return {(user_id, drill_id) for user_id, drill_id, _, _ in results}
+
+    assert drills(index.search(query, k=100)) == {("alice", "d1"), ("bob", "d1"), ("alice", "d2"), (None, "d3")}
+    # user_id なし: どのユーザーの d1 も除外する
+    assert drills(index.search(query, k=100, exclude_drill_id="d1")) == {("alice", "d2"), (None, "d3")}
+    # user_id あり: そのユーザーの d1 だけを除外する
+    assert drills(index.search(query, k=100, user_id="alice", exclude_drill_id="d1")) == {("alice", "d2")}
+    assert index.search(query, k=100, user_id="bob", exclude_drill_id="d1") == []
+    assert drills(index.search(query, k=100, user_id="bob", exclude_drill_id="d2")) == {("bob", "d1")}
+    assert index.search(query, k=100, user_id="nobody") == []
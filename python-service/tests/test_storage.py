@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from app import learning, storage
+from app.learning import load_learned_patterns
+from app.storage import FileLearningStore, SQLiteLearningStore
+
+from tests.conftest import prepared
+
+
+def test_save_and_get_drill(store):
+    drill = prepared("d1", "alice")
+    store.save_drill(drill, "alice")
+
+    assert store.get_drill("d1", "alice") == drill
+    assert store.get_drill("d1") is None
+    assert store.get_drill("missing", "alice") is None
+
+
+def test_same_drill_id_is_separate_per_user(store):
+    store.save_drills([
+        (prepared("shared", "alice", seed=1), "alice"),
+        (prepared("shared", "bob", seed=2), "bob"),
+        (prepared("shared", seed=3), None),
+    ])
+
+    assert store.get_drill("shared", "alice")["userId"] == "alice"
+    assert store.get_drill("shared", "bob")["userId"] == "bob"
+    assert store.get_drill("shared")["userId"] is None
+    assert len(list(store.iter_drills())) == 3
+    assert [d["userId"] for d in store.iter_drills("bob")] == ["bob"]
+
+
+def test_save_overwrites_same_key(store):
+    store.save_drill(prepared("d1", "alice", sets=3), "alice")
+    store.save_drill(prepared("d1", "alice", sets=5), "alice")
+
+    assert len(store.get_drill("d1", "alice")["sets"]) == 5
+    assert len(list(store.iter_drills("alice"))) == 1
+    assert store.compute_statistics("alice")["statistics"]["totalSets"] == 5
+
+
+def test_iter_drills_batches(store):
+    store.save_drills([(prepared(f"d{i}", "alice", seed=i), "alice") for i in range(7)])
+
+    drill_ids = sorted(d["drillId"] for d in store.iter_drills("alice", batch_size=2))
+    assert drill_ids == [f"d{i}" for i in range(7)]
+
+
+def test_list_drills_paginates(store):
+    store.save_drills([(prepared(f"d{i}", "alice", seed=i), "alice") for i in range(5)])
+    store.save_drill(prepared("other", "bob"), "bob")
+
+    first = store.list_drills("alice", limit=3)
+    rest = store.list_drills("alice", limit=3, offset=3)
+    assert len(first) == 3 and len(rest) == 2
+    assert {s["drillId"] for s in first + rest} == {f"d{i}" for i in range(5)}
+    assert all(s["userId"] == "alice" and s["setCount"] == 4 for s in first + rest)
+    assert len(store.list_drills()) == 6
+
+
+def test_query_sets_filters(store):
+    store.save_drill(prepared("d1", "alice"), "alice")
+    store.save_drill(prepared("d2", "bob"), "bob")
+
+    chorus = store.query_sets(section="chorus")
+    assert {(s["userId"], s["drillId"], s["setIndex"]) for s in chorus} == {("alice", "d1", 2), ("bob", "d2", 2)}
+
+    alice = store.query_sets(user_id="alice", limit=100)
+    assert len(alice) == 4
+    formation = alice[0]["formationType"]
+    assert all(s["formationType"] == formation for s in store.query_sets(user_id="alice", formation_type=formation))
+
+
+def test_statistics_match_between_backends(tmp_path):
+    items = [(prepared(f"d{i}", f"user-{i % 2}", seed=i), f"user-{i % 2}") for i in range(6)]
+    file_store = FileLearningStore(tmp_path / "files")
+    sqlite_store = SQLiteLearningStore(tmp_path / "learning.db")
+    file_store.save_drills(items)
+    sqlite_store.save_drills(items)
+
+    for user_id in (None, "user-0"):
+        expected = file_store.compute_statistics(user_id)
+        actual = sqlite_store.compute_statistics(user_id)
+        assert actual["statistics"] == pytest.approx(expected["statistics"])
+        assert actual["sectionPreferences"].keys() == expected["sectionPreferences"].keys()
+        for section, stats in expected["sectionPreferences"].items():
+            section_stats = actual["sectionPreferences"][section]
+            assert section_stats["count"] == stats["count"]
+            assert section_stats["formations"] == stats["formations"]
+            assert section_stats["avgMovementDistance"] == pytest.approx(stats["avgMovementDistance"])
+
+
+def test_empty_statistics(store):
+    assert store.compute_statistics()["statistics"] == {"totalDrills": 0, "totalSets": 0, "avgSetsPerDrill": 0}
+
+
+def test_iter_descriptors_and_set_context(store):
+    drill = prepared("d1", "alice")
+    store.save_drill(drill, "alice")
+
+    rows = list(store.iter_descriptors())
+    assert len(rows) == 1
+    seq, drill_id, user_id, matrix = rows[0]
+    assert (drill_id, user_id) == ("d1", "alice")
+    np.testing.assert_allclose(matrix, [s["descriptor"] for s in drill["sets"]], rtol=1e-6)
+    assert list(store.iter_descriptors(after=seq)) == []
+
+    context = store.get_set_context([("alice", "d1", 0), ("alice", "d1", 3), ("bob", "d1", 0)])
+    assert set(context) == {("alice", "d1", 0), ("alice", "d1", 3)}
+    assert context[("alice", "d1", 0)]["nextTransition"]["toSetId"] == "set-1"
+    assert context[("alice", "d1", 0)]["nextTransition"]["duration"] == 16.0
+    assert context[("alice", "d1", 3)]["nextTransition"] is None
+
+
+@pytest.mark.parametrize("drill_id, user_id", [("../x", None), ("a b", None), ("ok", "../../etc")])
+def test_rejects_unsafe_ids(store, drill_id, user_id):
+    drill = prepared("placeholder")
+    drill["drillId"] = drill_id
+    with pytest.raises(ValueError):
+        store.save_drill(drill, user_id)
+
+
+
+def test_generation_tracks_writes_from_other_connections(tmp_path):
+    first = SQLiteLearningStore(tmp_path / "learning.db")
+    other = SQLiteLearningStore(tmp_path / "learning.db")  # 別のワーカー・移行ツールに相当
+    generation = first.generation()
+
+    other.save_drill(prepared("d1"))
+
+    assert first.generation() > generation
+    # ファイルストアは他のプロセスの書き込みを検知できないため世代番号を持たない
+    assert FileLearningStore(tmp_path / "files").generation() is None
+
+
+def test_patterns_see_writes_from_other_processes(store, monkeypatch):
+    monkeypatch.setattr(storage, "_store", store)
+    monkeypatch.setattr(learning, "_statistics_cache", {})
+    assert load_learned_patterns()["statistics"]["totalDrills"] == 0
+
+    # 同じ場所を開いた別のストア（別のワーカー・移行ツール）からの書き込み
+    other = FileLearningStore(store.root) if isinstance(store, FileLearningStore) else SQLiteLearningStore(store.db_path)
+    other.save_drill(prepared("d1", "alice"), "alice")
+
+    assert load_learned_patterns()["statistics"]["totalDrills"] == 1
+    assert load_learned_patterns("alice")["statistics"]["totalDrills"] == 1
@@ -0,0 +1,162 @@
+import threading
+
+import pytest
+
+from app.learning import DrillData, prepare_drill_for_learning
+from app.writer import LearningWriter, WriterQueueFull
+
+from tests.conftest import make_drill
+
+
+class FailingStore:
+    """drillId が bad_ids に含まれるドリルを含む書き込みを失敗させるストア"""
+
+    def __init__(self, store, bad_ids):
+        self.store = store
+        self.bad_ids = set(bad_ids)
+        self.calls = []
+
+    def save_drills(self, items):
+        items = list(items)
+        self.calls.append([drill["drillId"] for drill, _ in items])
+        if any(drill["drillId"] in self.bad_ids for drill, _ in items):
+            raise RuntimeError("書き込み失敗")
+        return self.store.save_drills(items)
+
+
+def drill_data(drill_id, user_id=None, **kwargs):
+    return DrillData.model_validate(make_drill(drill_id, user_id, **kwargs))
+
+
+@pytest.fixture
+def writers():
+    created = []
+
+    def create(*args, **kwargs):
+        writer = LearningWriter(*args, **kwargs)
+        created.append(writer)
+        return writer
+
+    yield create
+    for writer in created:
+        writer.stop()
+
+
+def test_writes_submitted_drills(writers, active_store):
+    writer = writers(prepare_drill_for_learning, lambda: active_store)
+
+    coalesced, future = writer.submit(("alice", "d1"), drill_data("d1", "alice"))
+    future.result(timeout=10)
+
+    assert coalesced is False
+    assert active_store.get_drill("d1", "alice")["sets"][0]["formationType"] is not None
+    assert writer.stats()["written"] == 1
+
+
+def test_coalesces_resubmitted_drill(writers, active_store):
+    started = threading.Event()
+    release = threading.Event()
+
+    def prepare(drill):
+        # 1件目の書き込み中に同じドリルを再送させる
+        if drill.drillId == "blocker":
+            started.set()
+            release.wait(10)
+        return prepare_drill_for_learning(drill)
+
+    writer = writers(prepare, lambda: active_store)
+    writer.submit((None, "blocker"), drill_data("blocker"))
+    assert started.wait(10)
+
+    first = writer.submit(("alice", "d1"), drill_data("d1", "alice", sets=3))
+    second = writer.submit(("alice", "d1"), drill_data("d1", "alice", sets=6))
+    other_user = writer.submit(("bob", "d1"), drill_data("d1", "bob", sets=2))
+    release.set()
+    assert writer.flush(timeout=10)
+
+    assert first[0] is False and second[0] is True and other_user[0] is False
+    assert first[1] is second[1]
+    assert len(active_store.get_drill("d1", "alice")["sets"]) == 6
+    assert len(active_store.get_drill("d1", "bob")["sets"]) == 2
+    stats = writer.stats()
+    assert stats["coalesced"] == 1
+    assert stats["written"] == 3
+
+
+def test_failed_batch_is_retried_per_drill(writers, active_store):
+    started = threading.Event()
+    release = threading.Event()
+
+    def prepare(drill):
+        # 先行のドリルを書き込み中にしておき、残りの3件を1つのバッチにまとめさせる
+        if drill.drillId == "blocker":
+            started.set()
+            release.wait(10)
+        return prepare_drill_for_learning(drill)
+
+    failing = FailingStore(active_store, {"bad"})
+    writer = writers(prepare, lambda: failing)
+    writer.submit((None, "blocker"), drill_data("blocker"))
+    assert started.wait(10)
+    futures = {
+        drill_id: writer.submit((None, drill_id), drill_data(drill_id))[1]
+        for drill_id in ("good-1", "bad", "good-2")
+    }
+    release.set()
+    assert writer.flush(timeout=10)
+
+    assert futures["good-1"].result() is None
+    assert futures["good-2"].result() is None
+    with pytest.raises(RuntimeError):
+        futures["bad"].result()
+    assert active_store.get_drill("good-1") is not None
+    assert active_store.get_drill("good-2") is not None
+    assert active_store.get_drill("bad") is None
+    assert failing.calls[1:] == [["good-1", "bad", "good-2"], ["good-1"], ["bad"], ["good-2"]]
+    stats = writer.stats()
+    assert stats["written"] == 3
+    assert stats["failed"] == 1
+
+
+def test_prepare_failure_fails_only_that_drill(writers, active_store):
+    def prepare(drill):
+        if drill.drillId == "broken":
+            raise ValueError("特徴量を計算できません")
+        return prepare_drill_for_learning(drill)
+
+    writer = writers(prepare, lambda: active_store)
+    broken = writer.submit((None, "broken"), drill_data("broken"))[1]
+    ok = writer.submit((None, "ok"), drill_data("ok"))[1]
+    assert writer.flush(timeout=10)
+
+    with pytest.raises(ValueError):
+        broken.result()
+    assert ok.result() is None
+    assert active_store.get_drill("ok") is not None
+    assert writer.stats()["failed"] == 1
+
+
+def test_rejects_when_queue_is_full(writers, active_store):
+    started = threading.Event()
+    release = threading.Event()
+
+    def prepare(drill):
+        started.set()
+        release.wait(10)
+        return prepare_drill_for_learning(drill)
+
+    writer = writers(prepare, lambda: active_store, max_pending=2, batch_size=1)
+    writer.submit((None, "d0"), drill_data("d0"))
+    assert started.wait(10)
+    writer.submit((None, "d1"), drill_data("d1"))
+    writer.submit((None, "d2"), drill_data("d2"))
+
+    try:
+        with pytest.raises(WriterQueueFull):
+            writer.submit((None, "d3"), drill_data("d3"))
+        # キュー内のドリルの再送は上限に関係なく受け付ける
+        assert writer.submit((None, "d2"), drill_data("d2"))[0] is True
+    finally:
+        release.set()
+    assert writer.flush(timeout=10)
+    assert writer.stats()["written"] == 3